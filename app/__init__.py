@@ -24,6 +24,10 @@ def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
 
+    # jsonify() responses: keep insertion order and skip pretty-printing
+    app.json.sort_keys = False
+    app.json.compact = True
+
     db.init_app(app)
     
     # Ensure uploads folder exists and is properly configured
@@ -151,6 +155,9 @@ def create_app():
         except Exception as e:
             print(f"Error loading scheduled posts: {e}")
 
+    from .social.instagram_webhooks import init_instagram_webhooks
+    init_instagram_webhooks(app)
+
     from .routes import main_bp
     from .auth import auth_bp
     from .collab_routes import collab_bp
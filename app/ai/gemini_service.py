@@ -4,8 +4,10 @@ Gemini AI Service for generating personalized DM replies
 import google.generativeai as genai
 from flask import current_app
 import json
+import re
 import time
 from datetime import datetime
+from functools import lru_cache
 
 def initialize_gemini():
     """Initialize Gemini API with key from config"""
@@ -202,6 +204,16 @@ def is_within_business_hours():
     
     return settings.business_hours_start <= current_time <= settings.business_hours_end
 
+@lru_cache(maxsize=32)
+def _blacklist_pattern(blacklist_json):
+    """Compile the stored blacklist into one case-insensitive alternation regex"""
+    keywords = [kw for kw in json.loads(blacklist_json) if kw]
+    if not keywords:
+        return None
+    # Longest first so the reported match is the most specific keyword
+    keywords.sort(key=len, reverse=True)
+    return re.compile('|'.join(map(re.escape, keywords)), re.IGNORECASE)
+
 def should_auto_reply(message_text, conversation):
     """
     Determine if we should auto-reply to this message
@@ -248,11 +260,10 @@ def should_auto_reply(message_text, conversation):
     # Check blacklist keywords
     if settings.blacklist_keywords:
         try:
-            blacklist = json.loads(settings.blacklist_keywords)
-            message_lower = message_text.lower()
-            for keyword in blacklist:
-                if keyword.lower() in message_lower:
-                    return False, f"Blacklisted keyword: {keyword}"
+            pattern = _blacklist_pattern(settings.blacklist_keywords)
+            match = pattern.search(message_text) if pattern else None
+            if match:
+                return False, f"Blacklisted keyword: {match.group(0).lower()}"
         except:
             pass
     
@@ -12,8 +12,23 @@ from .models import (
     CommentDMTracker, db
 )
 from .ai.rag_chat import query_rag_system
-from .social.instagram_webhooks import send_instagram_message
-import threading
+from .social.instagram import API_BASE, get_session
+from .social.instagram_webhooks import send_instagram_message, get_config as get_instagram_config
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+
+# Comment automations run here instead of on a fresh thread per comment, so a
+# burst of comments can't spawn unbounded threads (replies may sleep for the
+# configured humanizing delay, hence a few workers)
+AUTOMATION_WORKERS = 8
+_AUTOMATION_EXECUTOR = ThreadPoolExecutor(max_workers=AUTOMATION_WORKERS, thread_name_prefix='comment-automation')
+atexit.register(_AUTOMATION_EXECUTOR.shutdown, wait=False)
+
+
+def _run_in_app(app_obj, func, *args):
+    """Pool entry point: run func inside an app context so models and current_app work"""
+    with app_obj.app_context():
+        func(*args)
 
 
 def handle_comment_event(comment_data, post_data):
@@ -57,22 +72,19 @@ def handle_comment_event(comment_data, post_data):
             current_app.logger.warning('Invalid comment data')
             return results
         
-        # Process in separate threads to not block webhook response
+        # Process on the automation pool to not block webhook response
+        app_obj = current_app._get_current_object()
         # 1. Auto-Comment Reply
-        auto_comment_thread = threading.Thread(
-            target=_process_auto_comment_reply,
-            args=(comment_id, comment_text, post_caption, user_id, username, post_id)
+        _AUTOMATION_EXECUTOR.submit(
+            _run_in_app, app_obj, _process_auto_comment_reply,
+            comment_id, comment_text, post_caption, user_id, username, post_id
         )
-        auto_comment_thread.daemon = True
-        auto_comment_thread.start()
         
         # 2. Comment-to-DM Trigger
-        comment_dm_thread = threading.Thread(
-            target=_process_comment_to_dm,
-            args=(comment_text, user_id, username, post_id, post_caption, comment_id)
+        _AUTOMATION_EXECUTOR.submit(
+            _run_in_app, app_obj, _process_comment_to_dm,
+            comment_text, user_id, username, post_id, post_caption, comment_id
         )
-        comment_dm_thread.daemon = True
-        comment_dm_thread.start()
         
         results['auto_comment_processed'] = True
         results['comment_to_dm_processed'] = True
@@ -283,19 +295,19 @@ def _post_comment_reply(comment_id, reply_text):
         dict: API response with comment ID, or None on failure
     """
     try:
-        access_token = current_app.config.get('INSTAGRAM_ACCESS_TOKEN')
+        access_token = get_instagram_config().access_token
         if not access_token:
             current_app.logger.error('INSTAGRAM_ACCESS_TOKEN not configured')
             return None
             
-        url = f'https://graph.facebook.com/v19.0/{comment_id}/replies'
+        url = f'{API_BASE}/{comment_id}/replies'
         
         payload = {
             'message': reply_text,
             'access_token': access_token
         }
         
-        response = requests.post(url, data=payload, timeout=10)
+        response = get_session().post(url, data=payload, timeout=10)
         response.raise_for_status()
         
         result = response.json()
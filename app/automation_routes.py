@@ -6,11 +6,37 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 import json
 from datetime import datetime, timedelta
 from . import db
+from .cache import TTLCache
 from .models import AutoReplySettings, CommentTrigger, AutomationLog, CommentDMTracker, ChatSettings
 from .auth import login_required, role_required
 
 automation_bp = Blueprint('automation', __name__, url_prefix='/automations')
 
+# The dashboard's 24h per-type log counts are served stale-while-revalidate:
+# within the TTL the cached dict is reused, after it the stale dict is shown
+# while one background thread recounts
+RECENT_COUNTS_TTL_SECONDS = 30
+_RECENT_COUNTS = TTLCache(maxsize=1, ttl=RECENT_COUNTS_TTL_SECONDS)
+
+
+def _count_recent_logs(app_obj):
+    """automation_type -> number of logs in the last 24 hours, in one GROUP BY"""
+    last_24h = datetime.utcnow() - timedelta(hours=24)
+    # Own app context so the background recount has a session too
+    with app_obj.app_context():
+        return dict(
+            db.session.query(AutomationLog.automation_type, db.func.count())
+            .filter(AutomationLog.created_at >= last_24h)
+            .group_by(AutomationLog.automation_type)
+            .all()
+        )
+
+
+def _recent_log_counts():
+    """Cached per-type counts for the last 24 hours"""
+    app_obj = current_app._get_current_object()
+    return _RECENT_COUNTS.get_or_revalidate('counts', lambda: _count_recent_logs(app_obj))
+
 
 @automation_bp.route('/')
 @login_required
@@ -22,16 +48,15 @@ def dashboard():
     dm_settings = ChatSettings.query.first()
     
     # Get recent activity stats
-    last_24h = datetime.utcnow() - timedelta(hours=24)
-    recent_logs = AutomationLog.query.filter(AutomationLog.created_at >= last_24h).all()
+    recent_counts = _recent_log_counts()
     
     stats = {
         'auto_comment_active': auto_reply_settings.is_active if auto_reply_settings else False,
         'active_triggers': active_triggers,
         'dm_auto_reply_active': dm_settings.auto_reply_enabled if dm_settings else False,
-        'comments_replied_24h': len([l for l in recent_logs if l.automation_type == 'auto_comment_reply']),
-        'dms_sent_24h': len([l for l in recent_logs if l.automation_type == 'comment_to_dm']),
-        'dm_replies_24h': len([l for l in recent_logs if l.automation_type == 'dm_auto_reply']),
+        'comments_replied_24h': recent_counts.get('auto_comment_reply', 0),
+        'dms_sent_24h': recent_counts.get('comment_to_dm', 0),
+        'dm_replies_24h': recent_counts.get('dm_auto_reply', 0),
     }
     
     return render_template('automation/dashboard.html', stats=stats)
@@ -232,37 +257,48 @@ def automation_logs():
 def automation_stats():
     """Dashboard with automation analytics"""
     # Get time-based stats
-    today = datetime.utcnow().date()
-    last_7_days = datetime.utcnow() - timedelta(days=7)
-    last_30_days = datetime.utcnow() - timedelta(days=30)
+    now = datetime.utcnow()
+    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    last_7_days = now - timedelta(days=7)
+    last_30_days = now - timedelta(days=30)
+    
+    # Every log count comes from one pass over the last 30 days; a range on
+    # created_at (not DATE(created_at)) keeps the filter index-friendly
+    def count_where(*conditions):
+        return db.func.sum(db.case((db.and_(*conditions), 1), else_=0))
+    
+    log_counts = db.session.query(
+        count_where(AutomationLog.created_at >= today_start),
+        count_where(AutomationLog.created_at >= today_start,
+                    AutomationLog.automation_type == 'auto_comment_reply'),
+        count_where(AutomationLog.created_at >= today_start,
+                    AutomationLog.automation_type == 'comment_to_dm'),
+        count_where(AutomationLog.created_at >= last_7_days),
+        db.func.count(),
+    ).filter(AutomationLog.created_at >= last_30_days).one()
+    today_total, today_auto_comment, today_comment_to_dm, week_total, month_total = (
+        int(n or 0) for n in log_counts
+    )
+    trigger_total, trigger_active = db.session.query(
+        db.func.count(),
+        count_where(CommentTrigger.is_active == True),
+    ).select_from(CommentTrigger).one()
     
     stats = {
         'today': {
-            'total': AutomationLog.query.filter(
-                db.func.date(AutomationLog.created_at) == today
-            ).count(),
-            'auto_comment': AutomationLog.query.filter(
-                db.func.date(AutomationLog.created_at) == today,
-                AutomationLog.automation_type == 'auto_comment_reply'
-            ).count(),
-            'comment_to_dm': AutomationLog.query.filter(
-                db.func.date(AutomationLog.created_at) == today,
-                AutomationLog.automation_type == 'comment_to_dm'
-            ).count(),
+            'total': today_total,
+            'auto_comment': today_auto_comment,
+            'comment_to_dm': today_comment_to_dm,
         },
         'week': {
-            'total': AutomationLog.query.filter(
-                AutomationLog.created_at >= last_7_days
-            ).count(),
+            'total': week_total,
         },
         'month': {
-            'total': AutomationLog.query.filter(
-                AutomationLog.created_at >= last_30_days
-            ).count(),
+            'total': month_total,
         },
         'triggers': {
-            'total': CommentTrigger.query.count(),
-            'active': CommentTrigger.query.filter_by(is_active=True).count(),
+            'total': trigger_total,
+            'active': int(trigger_active or 0),
         }
     }
     
@@ -0,0 +1,108 @@
+"""
+In-process TTL cache shared by the routes and Instagram helpers
+Entries live per worker process and are lost on restart, which is fine for
+status figures, username lookups and webhook dedup
+"""
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+def _start_daemon(func):
+    threading.Thread(target=func, daemon=True).start()
+
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize, ttl, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing = set()
+
+    def _store(self, key, value, ttl):
+        # Caller holds self._lock
+        self._data[key] = (value, self._clock() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at <= self._clock():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store value for ttl seconds (the cache's default ttl when None)"""
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def add(self, key, value=True):
+        """Insert key if absent (or expired); return False when it was already present"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] > self._clock():
+                return False
+            self._store(key, value, None)
+            return True
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return item[0] if item else default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_or_set(self, key, compute, ttl=None):
+        """Return the cached value for key, or store and return compute() on a miss"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.set(key, value, ttl)
+        return value
+
+    def get_or_revalidate(self, key, compute, run_in_background=_start_daemon):
+        """Stale-while-revalidate read of key.
+
+        A fresh entry is returned as is. An expired entry is still returned, and
+        the first caller to see it hands a refresh to run_in_background (a daemon
+        thread by default). With nothing cached, compute() runs inline.
+        """
+        with self._lock:
+            item = self._data.get(key)
+            stale = item is None or item[1] <= self._clock()
+            start_refresh = stale and key not in self._refreshing
+            if start_refresh:
+                self._refreshing.add(key)
+
+        if item is not None and not start_refresh:
+            return item[0]
+
+        def refresh():
+            try:
+                value = compute()
+                self.set(key, value)
+                return value
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        if item is None:
+            # Concurrent first reads compute on their own rather than wait
+            return refresh() if start_refresh else compute()
+        run_in_background(refresh)
+        return item[0]
@@ -3,6 +3,7 @@ from datetime import datetime
 from pytz import timezone as tz
 import os
 import json
+from sqlalchemy.orm import load_only
 from . import db
 from .models import PostDraft, User, Comment, Activity, ScheduledPost, TokenUsage
 from .auth import login_required, role_required, get_current_user
@@ -20,15 +21,22 @@ def drafts():
     # Lead and Co-Lead can see and manage everything
     # Members can see all drafts to work on content, media, and PR tasks
     # Exclude scheduled and published posts - they should only appear in "Scheduled" section
+    # The list only renders titles and status columns, so skip loading the
+    # post bodies, descriptions and image path blobs for every draft
+    list_columns = load_only(
+        PostDraft.id, PostDraft.title, PostDraft.platform, PostDraft.workflow_status,
+        PostDraft.content_status, PostDraft.media_status, PostDraft.tags_status,
+        PostDraft.created_by_id, PostDraft.created_at
+    )
     if current_user.position in ['Lead', 'Co-Lead'] or current_user.role == 'admin':
         # Leaders and admins see all drafts (except scheduled/published)
-        drafts = PostDraft.query.filter(
+        drafts = PostDraft.query.options(list_columns).filter(
             PostDraft.workflow_status.in_(['draft', 'review', 'approved'])
         ).order_by(PostDraft.created_at.desc()).all()
     else:
         # Members see all drafts (for collaborative workflow, except scheduled/published)
         # They can work on content, media, and PR sponsorship
-        drafts = PostDraft.query.filter(
+        drafts = PostDraft.query.options(list_columns).filter(
             PostDraft.workflow_status.in_(['draft', 'review', 'approved'])
         ).order_by(PostDraft.created_at.desc()).all()
     
@@ -132,7 +140,7 @@ def edit_draft(draft_id):
                 existing = []
                 if draft.image_path:
                     try:
-                        existing = json.loads(draft.image_path) if draft.image_path.startswith('[') else [draft.image_path]
+                        existing = draft.image_paths
                     except Exception:
                         existing = []
                 all_paths = existing + new_paths
@@ -405,7 +413,7 @@ def generate_caption_from_images(draft_id):
                 'error': 'No images uploaded yet'
             }), 400
         
-        image_paths = json.loads(draft.image_path)
+        image_paths = draft.image_paths
         
         # Add rate limiting check - max 5 caption generations per minute
         from datetime import timedelta
@@ -567,7 +575,7 @@ def remove_media(draft_id):
         media_index = data.get('index')
         
         if draft.image_path:
-            images = json.loads(draft.image_path)
+            images = draft.image_paths
             if 0 <= media_index < len(images):
                 removed_image = images.pop(media_index)
                 
@@ -2,14 +2,13 @@
 Direct Message Routes - Dedicated DM Management
 Separated from settings for better organization
 """
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, abort
 import json
-from datetime import datetime, timedelta
 from . import db
 from .models import DMConversation, DMMessage
 from .auth import login_required
-from .social.instagram_webhooks import send_instagram_message, _normalize_message_id
-from .social.instagram_dm_sync import sync_previous_instagram_dms, InstagramGraphPermissionError
+from .social.instagram_webhooks import send_manual_reply, set_conversation_status
+from .social.instagram_dm_sync import enqueue_dm_sync_from_form
 
 dm_bp = Blueprint('dm', __name__, url_prefix='/dm')
 
@@ -105,28 +104,10 @@ def api_get_conversations():
 @dm_bp.route('/sync', methods=['POST'])
 @login_required
 def sync_conversations():
-    """Sync previous Instagram DMs via Graph API"""
+    """Queue a background sync of previous Instagram DMs via Graph API"""
     try:
-        max_conversations = int(request.form.get('max_conversations', 50))
-        max_messages = int(request.form.get('max_messages', 50))
-
-        summary = sync_previous_instagram_dms(
-            max_conversations=max_conversations,
-            max_messages_per_conversation=max_messages,
-        )
-        flash(
-            f"Sync complete: {summary['messages_created']} messages added (skipped {summary['messages_skipped_existing']} existing).",
-            'success'
-        )
-    except InstagramGraphPermissionError as e:
-        if getattr(e, 'required_permission', None) == 'read_mailbox':
-            flash(
-                "Sync failed: Meta blocked access to inbox history. Your token/app needs the extended permission 'read_mailbox' (requires Meta App Review) to read previous conversations. "
-                "Until that permission is granted, we can only rely on webhooks for new messages.",
-                'error'
-            )
-        else:
-            flash(f"Sync failed: {e}", 'error')
+        job = enqueue_dm_sync_from_form(request.form)
+        flash(f"Sync started (job #{job.id}). New messages will appear as they are imported.", 'success')
     except Exception as e:
         flash(f"Sync failed: {e}", 'error')
 
@@ -144,28 +125,7 @@ def reply_conversation(conversation_id):
         flash('Reply cannot be empty.', 'error')
         return redirect(url_for('dm.conversations', conversation_id=conversation_id))
 
-    # Send via Instagram Graph
-    send_result = send_instagram_message(conversation.instagram_user_id, message_text)
-
-    # Record the outgoing message regardless of success so history is visible
-    message_id = _normalize_message_id(
-        send_result.get('message_id') or f"manual-{conversation_id}-{int(datetime.utcnow().timestamp())}",
-        sender_id=conversation.instagram_user_id,
-    )
-
-    outgoing = DMMessage(
-        conversation_id=conversation.id,
-        instagram_message_id=message_id,
-        sender_type='bot',
-        message_text=message_text,
-        is_auto_reply=False,
-        sent_successfully=send_result.get('success', False),
-        error_message=send_result.get('error'),
-    )
-    db.session.add(outgoing)
-
-    conversation.message_count = (conversation.message_count or 0) + 1
-    conversation.last_message_at = datetime.utcnow()
+    send_result = send_manual_reply(conversation, message_text)
 
     try:
         db.session.commit()
@@ -184,14 +144,15 @@ def reply_conversation(conversation_id):
 @login_required
 def update_conversation_status(conversation_id):
     """Update conversation status"""
-    conversation = DMConversation.query.get_or_404(conversation_id)
     new_status = request.form.get('status', 'active')
-    
-    if new_status in ['active', 'resolved', 'archived']:
-        conversation.conversation_status = new_status
+
+    try:
+        if not set_conversation_status(conversation_id, new_status):
+            abort(404)
+    except ValueError:
+        flash('Invalid status.', 'error')
+    else:
         db.session.commit()
         flash(f'Conversation status updated to {new_status}.', 'success')
-    else:
-        flash('Invalid status.', 'error')
-    
+
     return redirect(url_for('dm.conversations', conversation_id=conversation_id))
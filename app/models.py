@@ -1,3 +1,4 @@
+import json
 from datetime import datetime
 from . import db
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -83,7 +84,34 @@ class User(db.Model):
     def __repr__(self):
         return f'<User {self.username} ({self.role})>'
 
-class PostDraft(db.Model):
+def parse_image_paths(raw):
+    """Decode a stored image_path value (JSON array or bare legacy path) into a list"""
+    if not raw:
+        return []
+    return json.loads(raw) if raw.startswith('[') else [raw]
+
+class ImagePathsMixin:
+    """Memoized ``image_paths`` list for models that store ``image_path`` as JSON text"""
+
+    @property
+    def image_paths(self):
+        """
+        image_path as a list of paths (a bare legacy path becomes a one-item list)
+        
+        The decoded list is kept alongside the raw value it came from, so repeat
+        reads skip the JSON parse until image_path is reassigned.
+        Raises ValueError if image_path holds malformed JSON.
+        """
+        raw = self.image_path
+        if not raw:
+            return []
+        cached = getattr(self, '_image_paths_cache', None)
+        if cached is None or cached[0] is not raw:
+            cached = (raw, parse_image_paths(raw))
+            self._image_paths_cache = cached
+        return list(cached[1])
+
+class PostDraft(ImagePathsMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     platform = db.Column(db.String(32), nullable=False)
@@ -171,7 +199,7 @@ class Activity(db.Model):
     def __repr__(self):
         return f'<Activity {self.id} {self.action}>'
 
-class ScheduledPost(db.Model):
+class ScheduledPost(ImagePathsMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     platform = db.Column(db.String(32), nullable=False)  # 'instagram' or 'linkedin'
     content = db.Column(db.Text, nullable=False)
@@ -183,6 +211,11 @@ class ScheduledPost(db.Model):
     token_used = db.Column(db.Integer, default=0)  # API tokens consumed for this post
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Serves the status widget's queued count and the scheduler's due-post scan
+    __table_args__ = (
+        db.Index('ix_scheduled_post_status_time', 'status', 'scheduled_time'),
+    )
+
     def __repr__(self):
         return f'<ScheduledPost {self.id} {self.platform} {self.status}>'
 
@@ -223,7 +256,7 @@ class ChatSettings(db.Model):
 class DMConversation(db.Model):
     """Track DM conversations with users"""
     id = db.Column(db.Integer, primary_key=True)
-    instagram_user_id = db.Column(db.String(100), nullable=False)  # Instagram PSID
+    instagram_user_id = db.Column(db.String(100), nullable=False, unique=True)  # Instagram PSID
     instagram_username = db.Column(db.String(100))
     platform = db.Column(db.String(32), default='instagram')
     conversation_status = db.Column(db.String(32), default='active')  # active|resolved|archived (kept for backward compatibility)
@@ -251,10 +284,12 @@ class DMConversation(db.Model):
     def has_issues(self):
         """Check if conversation has failed messages or issues."""
         try:
-            return self.messages.filter(
-                DMMessage.sender_type == 'bot',
-                DMMessage.sent_successfully == False
-            ).count() > 0
+            return db.session.query(
+                self.messages.filter(
+                    DMMessage.sender_type == 'bot',
+                    DMMessage.sent_successfully == False
+                ).exists()
+            ).scalar()
         except:
             return False
     
@@ -271,10 +306,12 @@ class DMConversation(db.Model):
             ).order_by(DMMessage.created_at.desc()).limit(5).all()
             for msg in recent_user_msgs:
                 # Check if this message has a bot reply after it
-                has_reply = self.messages.filter(
-                    DMMessage.sender_type == 'bot',
-                    DMMessage.created_at > msg.created_at
-                ).first()
+                has_reply = db.session.query(
+                    self.messages.filter(
+                        DMMessage.sender_type == 'bot',
+                        DMMessage.created_at > msg.created_at
+                    ).exists()
+                ).scalar()
                 if not has_reply:
                     return True
             return False
@@ -300,6 +337,49 @@ class DMMessage(db.Model):
     
     def __repr__(self):
         return f'<DMMessage {self.sender_type} at {self.created_at}>'
+
+class DMSyncJob(db.Model):
+    """Background run of the Instagram DM history sync"""
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(32), default='queued')  # queued|running|completed|failed
+    max_conversations = db.Column(db.Integer, default=50)
+    max_messages = db.Column(db.Integer, default=50)
+    conversations_fetched = db.Column(db.Integer, default=0)
+    conversations_created = db.Column(db.Integer, default=0)
+    messages_created = db.Column(db.Integer, default=0)
+    messages_skipped = db.Column(db.Integer, default=0)
+    error_message = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'conversations_fetched': self.conversations_fetched,
+            'conversations_created': self.conversations_created,
+            'messages_created': self.messages_created,
+            'messages_skipped': self.messages_skipped,
+            'error_message': self.error_message,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+    
+    def __repr__(self):
+        return f'<DMSyncJob {self.id} {self.status}>'
+
+class WebhookInbox(db.Model):
+    """Durable queue of webhook text events awaiting background processing"""
+    id = db.Column(db.Integer, primary_key=True)
+    events = db.Column(db.Text, nullable=False)  # JSON array of extracted text events for one sender
+    status = db.Column(db.String(16), default='pending', index=True)  # pending|done|failed
+    error_message = db.Column(db.String(500))
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)  # pushed forward when replayed
+    processed_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<WebhookInbox {self.id} {self.status}>'
 # ============= AUTOMATION SUITE MODELS =============
 
 class AutoReplySettings(db.Model):
@@ -356,6 +436,14 @@ class AutomationLog(db.Model):
     comment_id = db.Column(db.String(100))  # Comment ID (if applicable)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Per-type log pages, the hourly rate-limit check and the dashboard's
+    # per-type counts seek on the first; the unfiltered newest-first log list
+    # and the 30-day stats range walk the second
+    __table_args__ = (
+        db.Index('ix_automation_log_type_created', 'automation_type', 'created_at'),
+        db.Index('ix_automation_log_created', 'created_at'),
+    )
+    
     def __repr__(self):
         return f'<AutomationLog {self.automation_type} success={self.success}>'
 
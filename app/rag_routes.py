@@ -2,14 +2,35 @@
 RAG System Status & Management Routes
 Monitor and manage the Hybrid RAG system for auto-replies
 """
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session, current_app
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import atexit
 import json
 from . import db
 from .auth import login_required, get_current_user
 
 rag_bp = Blueprint('rag', __name__, url_prefix='/rag')
 
+# Post ingestion (image fetch, vision caption, embedding, Pinecone upsert) takes
+# seconds, so the route validates and queues it here instead of waiting on it
+_INGEST_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix='rag-ingest')
+atexit.register(_INGEST_EXECUTOR.shutdown, wait=False)
+
+
+def _ingest_in_background(app_obj, post_fields):
+    """Ingest worker: run the ingestion pipeline for one post and log the outcome"""
+    with app_obj.app_context():
+        try:
+            from .ai.rag_ingest import get_ingestion_pipeline
+            success = get_ingestion_pipeline().ingest_post(**post_fields)
+            if success:
+                app_obj.logger.info(f"Post {post_fields['post_id']} ingested successfully")
+            else:
+                app_obj.logger.error(f"Ingestion failed for post {post_fields['post_id']}")
+        except Exception as e:
+            app_obj.logger.error(f"Ingestion error for post {post_fields['post_id']}: {e}")
+
 @rag_bp.route('/')
 @login_required
 def status():
@@ -138,32 +159,27 @@ def ingest_post():
     
     try:
         from .models import ScheduledPost
-        from .ai.rag_ingest import get_ingestion_pipeline
         
         post = ScheduledPost.query.get_or_404(post_id)
         
         if not post.image_path:
             return jsonify({'success': False, 'error': 'Post has no image to ingest'})
         
-        pipeline = get_ingestion_pipeline()
-        success = pipeline.ingest_post(
-            post_id=str(post.id),
-            image_url=post.image_path,
-            caption=post.caption or "",
-            platform=post.platform,
-            scheduled_time=post.scheduled_time
-        )
+        # Snapshot the fields now; the worker runs after this request's session is gone
+        post_fields = {
+            'post_id': str(post.id),
+            'image_url': post.image_path,
+            'caption': post.content or "",
+            'platform': post.platform,
+            'scheduled_time': post.scheduled_time,
+        }
+        _INGEST_EXECUTOR.submit(_ingest_in_background, current_app._get_current_object(), post_fields)
         
-        if success:
-            return jsonify({
-                'success': True,
-                'message': f'Post {post_id} ingested successfully'
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'error': 'Ingestion failed (check logs for details)'
-            })
+        return jsonify({
+            'success': True,
+            'queued': True,
+            'message': f'Post {post_id} queued for ingestion'
+        }), 202
     
     except Exception as e:
         return jsonify({
@@ -220,10 +236,13 @@ def stats():
         except Exception as e:
             pinecone_details = {'error': str(e)}
         
-        # Get DM statistics
-        total_conversations = DMConversation.query.count()
-        total_messages = DMMessage.query.count()
-        bot_messages = DMMessage.query.filter_by(sender_type='bot').count()
+        # Get DM statistics: the bot share comes from the same pass as the total
+        total_conversations = db.session.query(db.func.count()).select_from(DMConversation).scalar()
+        total_messages, bot_messages = db.session.query(
+            db.func.count(),
+            db.func.sum(db.case((DMMessage.sender_type == 'bot', 1), else_=0)),
+        ).select_from(DMMessage).one()
+        bot_messages = int(bot_messages or 0)
         
         dm_stats = {
             'total_conversations': total_conversations,
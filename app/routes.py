@@ -5,13 +5,12 @@ from . import db
 from .models import ScheduledPost, TokenUsage
 from .auth import login_required
 from .utils import download_image_to_uploads
+from .cache import TTLCache
 
 # In-process cache for account status to avoid repeated Meta API calls.
 # This resets on deploy/restart (which is fine for status checks).
-_ACCOUNT_STATUS_CACHE = {
-    'value': None,
-    'expires_at': None,
-}
+_ACCOUNT_STATUS_CACHE = TTLCache(maxsize=1, ttl=300)
+ACCOUNT_STATUS_ERROR_CACHE_SECONDS = 10
 
 def convert_local_to_utc(local_dt, tz_name='Asia/Kolkata'):
     """Convert local datetime to UTC.
@@ -228,8 +227,8 @@ def edit_post(post_id):
                 import json
                 # If existing images, append; otherwise create list
                 try:
-                    existing = json.loads(post.image_path) if post.image_path and post.image_path.startswith('[') else ([post.image_path] if post.image_path else [])
-                except Exception:
+                    existing = post.image_paths
+                except ValueError:
                     existing = []
                 existing.append(saved)
                 post.image_path = json.dumps(existing)
@@ -302,11 +301,9 @@ def account_status():
         cache_ttl = 300
     cache_ttl = max(0, cache_ttl)
 
-    now = datetime.utcnow()
     if not force and cache_ttl > 0:
-        cached_value = _ACCOUNT_STATUS_CACHE.get('value')
-        expires_at = _ACCOUNT_STATUS_CACHE.get('expires_at')
-        if cached_value is not None and expires_at and expires_at > now:
+        cached_value = _ACCOUNT_STATUS_CACHE.get('payload')
+        if cached_value is not None:
             return jsonify(cached_value)
     
     instagram_status = check_instagram_account_status()
@@ -329,7 +326,7 @@ def account_status():
             webhook_last_event_at = last_msg.created_at.isoformat() if last_msg.created_at else None
         else:
             # Fall back to conversation existence
-            webhook_linked_previously = DMConversation.query.count() > 0
+            webhook_linked_previously = db.session.query(DMConversation.query.exists()).scalar()
     except Exception:
         # DB may be unavailable/misconfigured; return unknown rather than failing the endpoint
         webhook_linked_previously = None
@@ -344,9 +341,11 @@ def account_status():
         'instagram': instagram_status,
     }
 
+    # Errors are only held briefly so fixed credentials show up on the next poll
+    if isinstance(instagram_status, dict) and instagram_status.get('status') != 'connected':
+        cache_ttl = min(cache_ttl, ACCOUNT_STATUS_ERROR_CACHE_SECONDS)
     if cache_ttl > 0:
-        _ACCOUNT_STATUS_CACHE['value'] = payload
-        _ACCOUNT_STATUS_CACHE['expires_at'] = now + timedelta(seconds=cache_ttl)
+        _ACCOUNT_STATUS_CACHE.set('payload', payload, ttl=cache_ttl)
 
     return jsonify(payload)
 
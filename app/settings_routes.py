@@ -2,16 +2,24 @@
 Chat Control Settings Routes
 Manage auto-reply settings, rate limits, and automation controls
 """
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, abort
 import json
 from datetime import datetime, timedelta
+from sqlalchemy import func, case
 from . import db
-from .models import ChatSettings, DMConversation, DMMessage
+from .models import ChatSettings, DMConversation, DMMessage, DMSyncJob
 from .auth import login_required, role_required
-from .social.instagram_webhooks import send_instagram_message, _normalize_message_id
+from .social.instagram_webhooks import send_manual_reply, set_conversation_status
 
 settings_bp = Blueprint('settings', __name__, url_prefix='/settings')
 
+# Toggle route name -> (ChatSettings boolean column, flash label)
+TOGGLE_SETTINGS = {
+    'auto_reply': ('auto_reply_enabled', 'Auto-reply'),
+    'auto_comment': ('auto_comment_enabled', 'Auto-comment'),
+    'business_hours': ('business_hours_only', 'Business hours restriction'),
+}
+
 def get_or_create_settings():
     """Get existing settings or create default"""
     settings = ChatSettings.query.first()
@@ -29,6 +37,14 @@ def get_or_create_settings():
         db.session.commit()
     return settings
 
+def parse_csv_field(form_key, lowercase=False):
+    """Parse a comma-separated form field into a JSON array string (None if empty)"""
+    raw = request.form.get(form_key, '')
+    if lowercase:
+        raw = raw.lower()
+    values = list(dict.fromkeys(filter(None, (item.strip() for item in raw.split(',')))))
+    return json.dumps(values) if values else None
+
 @settings_bp.route('/')
 @login_required
 def index():
@@ -51,23 +67,25 @@ def index():
         except:
             pass
     
-    # Get statistics
-    total_conversations = DMConversation.query.count()
-    active_conversations = DMConversation.query.filter_by(conversation_status='active').count()
+    # Get statistics: one pass per table, each count a SUM(CASE ...) column
+    total_conversations, active_conversations = db.session.query(
+        func.count(),
+        func.sum(case((DMConversation.conversation_status == 'active', 1), else_=0)),
+    ).select_from(DMConversation).one()
+    active_conversations = int(active_conversations or 0)
     
-    # Auto-replies in last 24 hours
-    one_day_ago = datetime.utcnow() - timedelta(hours=24)
-    auto_replies_24h = DMMessage.query.filter(
+    # Auto-replies in the last 24 hours and in the last hour
+    now = datetime.utcnow()
+    one_day_ago = now - timedelta(hours=24)
+    one_hour_ago = now - timedelta(hours=1)
+    auto_replies_24h, auto_replies_1h = db.session.query(
+        func.count(),
+        func.sum(case((DMMessage.created_at >= one_hour_ago, 1), else_=0)),
+    ).filter(
         DMMessage.is_auto_reply == True,
         DMMessage.created_at >= one_day_ago
-    ).count()
-    
-    # Auto-replies in last hour
-    one_hour_ago = datetime.utcnow() - timedelta(hours=1)
-    auto_replies_1h = DMMessage.query.filter(
-        DMMessage.is_auto_reply == True,
-        DMMessage.created_at >= one_hour_ago
-    ).count()
+    ).one()
+    auto_replies_1h = int(auto_replies_1h or 0)
     
     stats = {
         'total_conversations': total_conversations,
@@ -117,21 +135,11 @@ def update_settings():
     if fallback_message:
         settings.fallback_message = fallback_message
     
-    # Blacklist keywords
-    blacklist_str = request.form.get('blacklist_keywords', '').strip()
-    if blacklist_str:
-        blacklist = [kw.strip() for kw in blacklist_str.split(',') if kw.strip()]
-        settings.blacklist_keywords = json.dumps(blacklist)
-    else:
-        settings.blacklist_keywords = None
+    # Blacklist keywords (stored lowercase; moderation matching is case-insensitive)
+    settings.blacklist_keywords = parse_csv_field('blacklist_keywords', lowercase=True)
     
     # Whitelist users
-    whitelist_str = request.form.get('whitelist_users', '').strip()
-    if whitelist_str:
-        whitelist = [user.strip() for user in whitelist_str.split(',') if user.strip()]
-        settings.whitelist_users = json.dumps(whitelist)
-    else:
-        settings.whitelist_users = None
+    settings.whitelist_users = parse_csv_field('whitelist_users')
     
     db.session.commit()
     
@@ -143,25 +151,39 @@ def update_settings():
 @role_required('admin', 'approver')
 def toggle_setting(setting_name):
     """Quick toggle for boolean settings"""
-    settings = get_or_create_settings()
+    # The page's toggles post via fetch and update in place; a plain form post
+    # (no JS) still gets the flash + redirect
+    wants_json = request.accept_mimetypes.best == 'application/json'
     
-    if setting_name == 'auto_reply':
-        settings.auto_reply_enabled = not settings.auto_reply_enabled
-        status = 'enabled' if settings.auto_reply_enabled else 'disabled'
-        flash(f'Auto-reply {status}.', 'success')
-    elif setting_name == 'auto_comment':
-        settings.auto_comment_enabled = not settings.auto_comment_enabled
-        status = 'enabled' if settings.auto_comment_enabled else 'disabled'
-        flash(f'Auto-comment {status}.', 'success')
-    elif setting_name == 'business_hours':
-        settings.business_hours_only = not settings.business_hours_only
-        status = 'enabled' if settings.business_hours_only else 'disabled'
-        flash(f'Business hours restriction {status}.', 'success')
-    else:
+    toggle = TOGGLE_SETTINGS.get(setting_name)
+    if not toggle:
+        if wants_json:
+            return jsonify({'success': False, 'error': 'Invalid setting name.'}), 400
         flash('Invalid setting name.', 'error')
+        return redirect(url_for('settings.index'))
+    
+    column_name, label = toggle
+    column = getattr(ChatSettings, column_name)
     
+    # Flip the flag in SQL (NOT col) rather than SELECT + modify + UPDATE
+    toggled = ChatSettings.query.update({column: ~column}, synchronize_session=False)
+    if not toggled:
+        # No settings row yet: create defaults, then flip
+        get_or_create_settings()
+        ChatSettings.query.update({column: ~column}, synchronize_session=False)
     db.session.commit()
     
+    enabled = db.session.query(column).limit(1).scalar()
+    status = 'enabled' if enabled else 'disabled'
+    if wants_json:
+        return jsonify({
+            'success': True,
+            'setting': setting_name,
+            'enabled': bool(enabled),
+            'message': f'{label} {status}.',
+        })
+    flash(f'{label} {status}.', 'success')
+    
     return redirect(url_for('settings.index'))
 
 @settings_bp.route('/api/status')
@@ -177,6 +199,9 @@ def api_status():
         DMMessage.created_at >= one_hour_ago
     ).count()
     
+    # Most recent background DM sync, so the UI can poll its progress
+    last_sync = DMSyncJob.query.order_by(DMSyncJob.id.desc()).first()
+    
     return jsonify({
         'auto_reply_enabled': settings.auto_reply_enabled,
         'auto_comment_enabled': settings.auto_comment_enabled,
@@ -184,7 +209,8 @@ def api_status():
         'reply_rate_limit': settings.reply_rate_limit,
         'auto_replies_1h': auto_replies_1h,
         'remaining_1h': max(0, settings.reply_rate_limit - auto_replies_1h),
-        'updated_at': settings.updated_at.isoformat() if settings.updated_at else None
+        'updated_at': settings.updated_at.isoformat() if settings.updated_at else None,
+        'last_sync': last_sync.to_dict() if last_sync else None,
     })
 
 @settings_bp.route('/conversations')
@@ -212,13 +238,15 @@ def conversations():
 
         messages = selected_conversation.messages.order_by(DMMessage.created_at.asc()).all()
     
-    # Get status counts
-    status_counts = {
-        'all': DMConversation.query.count(),
-        'active': DMConversation.query.filter_by(conversation_status='active').count(),
-        'resolved': DMConversation.query.filter_by(conversation_status='resolved').count(),
-        'archived': DMConversation.query.filter_by(conversation_status='archived').count(),
-    }
+    # Get status counts in a single query (COUNT(CASE ...) works on MySQL, Postgres and SQLite)
+    status_col = DMConversation.conversation_status
+    counts = db.session.query(
+        func.count(DMConversation.id),
+        func.count(case((status_col == 'active', 1))),
+        func.count(case((status_col == 'resolved', 1))),
+        func.count(case((status_col == 'archived', 1))),
+    ).one()
+    status_counts = dict(zip(('all', 'active', 'resolved', 'archived'), counts))
     
     return render_template(
         'dm/conversations.html',
@@ -234,30 +262,12 @@ def conversations():
 @settings_bp.route('/conversations/sync', methods=['POST'])
 @login_required
 def sync_conversations():
-    """Sync previous Instagram DMs via Graph API (best-effort)."""
+    """Queue a background sync of previous Instagram DMs via Graph API (best-effort)."""
     try:
-        from .social.instagram_dm_sync import sync_previous_instagram_dms, InstagramGraphPermissionError
-
-        max_conversations = int(request.form.get('max_conversations', 50))
-        max_messages = int(request.form.get('max_messages', 50))
+        from .social.instagram_dm_sync import enqueue_dm_sync_from_form
 
-        summary = sync_previous_instagram_dms(
-            max_conversations=max_conversations,
-            max_messages_per_conversation=max_messages,
-        )
-        flash(
-            f"Sync complete: {summary['messages_created']} messages added (skipped {summary['messages_skipped_existing']} existing).",
-            'success'
-        )
-    except InstagramGraphPermissionError as e:
-        if getattr(e, 'required_permission', None) == 'read_mailbox':
-            flash(
-                "Sync failed: Meta blocked access to inbox history. Your token/app needs the extended permission 'read_mailbox' (requires Meta App Review) to read previous conversations. "
-                "Until that permission is granted, we can only rely on webhooks for new messages.",
-                'error'
-            )
-        else:
-            flash(f"Sync failed: {e}", 'error')
+        job = enqueue_dm_sync_from_form(request.form)
+        flash(f"Sync started (job #{job.id}). Check sync status for progress.", 'success')
     except Exception as e:
         flash(f"Sync failed: {e}", 'error')
 
@@ -278,16 +288,17 @@ def view_conversation(conversation_id):
 @login_required
 def update_conversation_status(conversation_id):
     """Update conversation status"""
-    conversation = DMConversation.query.get_or_404(conversation_id)
     new_status = request.form.get('status', 'active')
-    
-    if new_status in ['active', 'resolved', 'archived']:
-        conversation.conversation_status = new_status
+
+    try:
+        if not set_conversation_status(conversation_id, new_status):
+            abort(404)
+    except ValueError:
+        flash('Invalid status.', 'error')
+    else:
         db.session.commit()
         flash(f'Conversation status updated to {new_status}.', 'success')
-    else:
-        flash('Invalid status.', 'error')
-    
+
     return redirect(url_for('settings.view_conversation', conversation_id=conversation_id))
 
 
@@ -302,28 +313,7 @@ def reply_conversation(conversation_id):
         flash('Reply cannot be empty.', 'error')
         return redirect(url_for('settings.conversations', conversation_id=conversation_id))
 
-    # Send via Instagram Graph
-    send_result = send_instagram_message(conversation.instagram_user_id, message_text)
-
-    # Record the outgoing message regardless of success so history is visible
-    message_id = _normalize_message_id(
-        send_result.get('message_id') or f"manual-{conversation_id}-{int(datetime.utcnow().timestamp())}",
-        sender_id=conversation.instagram_user_id,
-    )
-
-    outgoing = DMMessage(
-        conversation_id=conversation.id,
-        instagram_message_id=message_id,
-        sender_type='bot',
-        message_text=message_text,
-        is_auto_reply=False,
-        sent_successfully=send_result.get('success', False),
-        error_message=send_result.get('error'),
-    )
-    db.session.add(outgoing)
-
-    conversation.message_count = (conversation.message_count or 0) + 1
-    conversation.last_message_at = datetime.utcnow()
+    send_result = send_manual_reply(conversation, message_text)
 
     try:
         db.session.commit()
@@ -1,9 +1,29 @@
+import os
+import sys
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
 from flask import current_app
 
 API_BASE = 'https://graph.facebook.com/v19.0'
 
+# Shared session so Graph API calls reuse pooled keep-alive connections.
+# Retries only apply to idempotent methods, so DM sends are never duplicated.
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=50,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504]),
+))
+
+def get_session():
+    """Pooled session for Graph API calls, shared by the Instagram modules"""
+    return _SESSION
+
+# Upper bound on concurrent carousel item uploads (Instagram allows 10 items)
+MAX_CAROUSEL_WORKERS = 10
+
 def check_instagram_account_status():
     """Check if Instagram credentials are valid and return account info"""
     token = current_app.config.get('INSTAGRAM_ACCESS_TOKEN')
@@ -18,7 +38,7 @@ def check_instagram_account_status():
     
     try:
         # Verify the business account exists and token is valid
-        response = requests.get(
+        response = _SESSION.get(
             f"{API_BASE}/{business_id}",
             params={
                 'fields': 'id,username,name,profile_picture_url',
@@ -58,6 +78,34 @@ def check_instagram_account_status():
             'message': str(e)
         }
 
+def _to_image_url(image_path, upload_prefix):
+    """Return a public URL for an image path (URLs are passed through unchanged)."""
+    if image_path.startswith(('http://', 'https://')):
+        return image_path
+    # Convert local file path to public URL under /uploads/
+    return upload_prefix + os.path.basename(image_path)
+
+def _create_carousel_item(media_endpoint, image_url, token):
+    """Create a single carousel child container and return its media id."""
+    print(f'[DEBUG] Creating carousel item with URL: {image_url}', file=sys.stderr)
+    
+    data = {
+        'image_url': image_url,
+        'is_carousel_item': 'true',
+        'access_token': token
+    }
+    resp = _SESSION.post(media_endpoint, data=data, timeout=30)
+    print(f'[DEBUG] Carousel item response status: {resp.status_code}', file=sys.stderr)
+    if resp.status_code >= 300:
+        error_data = resp.json() if resp.headers.get('content-type', '').startswith('application/json') else {'message': resp.text}
+        error_msg = error_data.get('error', {}).get('message', error_data.get('message', resp.text))
+        raise RuntimeError(
+            f'Instagram carousel item create failed (HTTP {resp.status_code}): {error_msg}. '
+            f'Image URL: {image_url}. '
+            f'Ensure the URL is publicly accessible and uses HTTPS.'
+        )
+    return resp.json().get('id')
+
 def post_to_instagram(post):
     token = current_app.config.get('INSTAGRAM_ACCESS_TOKEN')
     business_id = current_app.config.get('INSTAGRAM_BUSINESS_ACCOUNT_ID')
@@ -84,40 +132,28 @@ def post_to_instagram(post):
     
     # Parse image paths (can be JSON array or single path)
     try:
-        image_paths = json.loads(post.image_path) if post.image_path.startswith('[') else [post.image_path]
-    except (json.JSONDecodeError, AttributeError) as e:
+        image_paths = post.image_paths
+    except ValueError as e:
         raise ValueError(f'Invalid image path format: {str(e)}')
     
     if not image_paths:
         raise ValueError('Instagram post requires at least one image.')
     
     # Verify image files exist
-    import os
-    for img_path in image_paths:
-        if not os.path.exists(img_path):
-            raise FileNotFoundError(f'Image file not found: {img_path}. Please upload the image again.')
+    missing = next((img_path for img_path in image_paths if not os.path.exists(img_path)), None)
+    if missing:
+        raise FileNotFoundError(f'Image file not found: {missing}. Please upload the image again.')
+    
+    # Endpoint and public upload prefix are shared by every media call below
+    media_endpoint = f"{API_BASE}/{business_id}/media"
+    upload_prefix = public_url.rstrip('/') + '/uploads/'
     
     # Single image post
     if len(image_paths) == 1:
-        media_endpoint = f"{API_BASE}/{business_id}/media"
-        
         # Instagram requires a publicly accessible image URL
-        # Check if the path is already a URL or needs conversion
-        image_path = image_paths[0]
-        if image_path.startswith('http://') or image_path.startswith('https://'):
-            # Already a URL, use directly
-            image_url = image_path
-        else:
-            # Convert local file path to public URL
-            import os
-            filename = os.path.basename(image_path)
-            public_url = current_app.config.get('PUBLIC_URL', 'http://127.0.0.1:5000')
-            # Ensure URL ends with /uploads/ for proper routing
-            public_url = public_url.rstrip('/')
-            image_url = f"{public_url}/uploads/{filename}"
+        image_url = _to_image_url(image_paths[0], upload_prefix)
         
         # Log the image URL for debugging
-        import sys
         print(f'[DEBUG] Attempting to create Instagram media with URL: {image_url}', file=sys.stderr)
         
         data = {
@@ -125,7 +161,7 @@ def post_to_instagram(post):
             'caption': post.content,
             'access_token': token
         }
-        resp = requests.post(media_endpoint, data=data, timeout=30)
+        resp = _SESSION.post(media_endpoint, data=data, timeout=30)
         print(f'[DEBUG] Instagram response status: {resp.status_code}', file=sys.stderr)
         if resp.status_code >= 300:
             error_data = resp.json() if resp.headers.get('content-type', '').startswith('application/json') else {'message': resp.text}
@@ -140,54 +176,26 @@ def post_to_instagram(post):
             raise RuntimeError('No creation id returned from Instagram API. Response: ' + str(resp.json()))
     else:
         # Carousel post with multiple images
-        media_ids = []
-        for img_path in image_paths:
-            media_endpoint = f"{API_BASE}/{business_id}/media"
-            
-            # Check if the path is already a URL or needs conversion
-            if img_path.startswith('http://') or img_path.startswith('https://'):
-                # Already a URL, use directly
-                image_url = img_path
-            else:
-                # Convert local file path to public URL
-                import os
-                filename = os.path.basename(img_path)
-                public_url = current_app.config.get('PUBLIC_URL', 'http://127.0.0.1:5000')
-                # Ensure URL ends properly for proper routing
-                public_url = public_url.rstrip('/')
-                image_url = f"{public_url}/uploads/{filename}"
-            
-            import sys
-            print(f'[DEBUG] Creating carousel item with URL: {image_url}', file=sys.stderr)
-            
-            data = {
-                'image_url': image_url,
-                'is_carousel_item': 'true',
-                'access_token': token
-            }
-            resp = requests.post(media_endpoint, data=data, timeout=30)
-            print(f'[DEBUG] Carousel item response status: {resp.status_code}', file=sys.stderr)
-            if resp.status_code >= 300:
-                error_data = resp.json() if resp.headers.get('content-type', '').startswith('application/json') else {'message': resp.text}
-                error_msg = error_data.get('error', {}).get('message', error_data.get('message', resp.text))
-                raise RuntimeError(
-                    f'Instagram carousel item create failed (HTTP {resp.status_code}): {error_msg}. '
-                    f'Image URL: {image_url}. '
-                    f'Ensure the URL is publicly accessible and uses HTTPS.'
-                )
-            media_id = resp.json().get('id')
-            if media_id:
-                media_ids.append(media_id)
+        image_urls = [_to_image_url(img_path, upload_prefix) for img_path in image_paths]
+
+        # Each item is an independent Graph API round-trip, so upload them
+        # concurrently; map() keeps the results in carousel order.
+        workers = min(MAX_CAROUSEL_WORKERS, len(image_urls))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            item_ids = list(executor.map(
+                lambda url: _create_carousel_item(media_endpoint, url, token),
+                image_urls,
+            ))
+        media_ids = [media_id for media_id in item_ids if media_id]
         
         # Create carousel container
-        carousel_endpoint = f"{API_BASE}/{business_id}/media"
         carousel_data = {
             'media_type': 'CAROUSEL',
             'children': ','.join(media_ids),
             'caption': post.content,
             'access_token': token
         }
-        carousel_resp = requests.post(carousel_endpoint, data=carousel_data, timeout=30)
+        carousel_resp = _SESSION.post(media_endpoint, data=carousel_data, timeout=30)
         if carousel_resp.status_code >= 300:
             error_data = carousel_resp.json() if carousel_resp.headers.get('content-type', '').startswith('application/json') else {'message': carousel_resp.text}
             error_msg = error_data.get('error', {}).get('message', error_data.get('message', carousel_resp.text))
@@ -198,7 +206,7 @@ def post_to_instagram(post):
     
     # Publish media
     publish_endpoint = f"{API_BASE}/{business_id}/media_publish"
-    pub_resp = requests.post(publish_endpoint, data={'creation_id': creation_id, 'access_token': token}, timeout=30)
+    pub_resp = _SESSION.post(publish_endpoint, data={'creation_id': creation_id, 'access_token': token}, timeout=30)
     if pub_resp.status_code >= 300:
         error_data = pub_resp.json() if pub_resp.headers.get('content-type', '').startswith('application/json') else {'message': pub_resp.text}
         error_msg = error_data.get('error', {}).get('message', error_data.get('message', pub_resp.text))
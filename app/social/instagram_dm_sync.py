@@ -1,9 +1,15 @@
-import requests
-from datetime import datetime
+import json
+import time
+from datetime import datetime, timezone
 from flask import current_app
 
+from .instagram import get_session
+
 API_BASE = 'https://graph.facebook.com/v19.0'
 
+# Longest Retry-After we are willing to honor inside a request before giving up
+MAX_RETRY_AFTER_SECONDS = 30
+
 
 class InstagramGraphPermissionError(RuntimeError):
     def __init__(self, message: str, required_permission: str | None = None):
@@ -22,8 +28,20 @@ def _get_token_and_business_id():
 def _iter_paged(url, params=None, max_pages=50, timeout=20):
     """Iterate through Graph API pagination. Yields each response JSON."""
     pages = 0
+    rate_limited = False
     while url and pages < max_pages:
-        resp = requests.get(url, params=params if pages == 0 else None, timeout=timeout)
+        # Paging "next" links already embed the cursor and query, so params only go with page 0
+        resp = get_session().get(url, params=params, timeout=timeout)
+        if resp.status_code == 429 and not rate_limited:
+            # Back off once as instructed by Graph API, then retry the same page
+            rate_limited = True
+            try:
+                retry_after = int(resp.headers.get('Retry-After', 1))
+            except ValueError:
+                retry_after = 1
+            time.sleep(min(max(retry_after, 0), MAX_RETRY_AFTER_SECONDS))
+            continue
+        rate_limited = False
         if resp.status_code >= 300:
             try:
                 err = resp.json()
@@ -48,7 +66,7 @@ def _iter_paged(url, params=None, max_pages=50, timeout=20):
 
             raise RuntimeError(f'Graph API error (HTTP {resp.status_code}): {err}')
 
-        data = resp.json()
+        data = json.loads(resp.content)
         yield data
 
         paging = data.get('paging') or {}
@@ -93,7 +111,7 @@ def fetch_instagram_conversations(limit=50):
     raise RuntimeError(f'Unable to fetch conversations from Graph API: {last_error}')
 
 
-def fetch_conversation_messages(conversation_id, limit=50):
+def fetch_conversation_messages(conversation_id, limit=50, max_pages=10):
     """Fetch messages for a conversation/thread."""
     token, _ = _get_token_and_business_id()
 
@@ -106,7 +124,7 @@ def fetch_conversation_messages(conversation_id, limit=50):
     }
 
     messages = []
-    for page in _iter_paged(url, params=params, max_pages=50):
+    for page in _iter_paged(url, params=params, max_pages=max_pages):
         messages.extend(page.get('data') or [])
 
     return messages
@@ -115,19 +133,20 @@ def fetch_conversation_messages(conversation_id, limit=50):
 def _parse_graph_dt(value):
     if not value:
         return None
-    # Graph timestamps are usually ISO 8601 like 2020-01-01T00:00:00+0000
-    for fmt in ("%Y-%m-%dT%H:%M:%S%z", "%Y-%m-%dT%H:%M:%S%z"):
-        try:
-            dt = datetime.strptime(value, fmt)
-            # Store naive UTC in DB (existing code uses utcnow())
-            return dt.astimezone(tz=None).replace(tzinfo=None)
-        except Exception:
-            continue
+    # Graph timestamps are ISO 8601 like 2020-01-01T00:00:00+0000, which the
+    # C-implemented fromisoformat handles on Python 3.11+; strptime is only the
+    # fallback for anything it rejects
     try:
-        # Try Python's parser for +00:00 style if present
-        return datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None)
-    except Exception:
-        return None
+        dt = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        try:
+            dt = datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z")
+        except (TypeError, ValueError):
+            return None
+    if dt.tzinfo is not None:
+        # Store naive UTC in DB (existing code uses utcnow())
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
 
 
 def sync_previous_instagram_dms(max_conversations=50, max_messages_per_conversation=50):
@@ -206,7 +225,9 @@ def sync_previous_instagram_dms(max_conversations=50, max_messages_per_conversat
                 continue
 
             # Avoid duplicates via unique instagram_message_id
-            if DMMessage.query.filter_by(instagram_message_id=mid).first():
+            if db.session.query(
+                db.exists().where(DMMessage.instagram_message_id == mid)
+            ).scalar():
                 skipped_messages += 1
                 continue
 
@@ -239,3 +260,83 @@ def sync_previous_instagram_dms(max_conversations=50, max_messages_per_conversat
         'messages_created': created_messages,
         'messages_skipped_existing': skipped_messages,
     }
+
+
+# Friendly message for the most common permission failure
+READ_MAILBOX_ERROR = (
+    "Meta blocked access to inbox history. Your token/app needs the extended permission 'read_mailbox' "
+    "(requires Meta App Review) to read previous conversations. "
+    "Until that permission is granted, we can only rely on webhooks for new messages."
+)
+
+
+def enqueue_dm_sync(max_conversations=50, max_messages_per_conversation=50):
+    """Record a DMSyncJob and run the sync on the background scheduler.
+
+    Returns the queued job so callers can report its id immediately.
+    """
+    from .. import db, get_scheduler
+    from ..models import DMSyncJob
+
+    job = DMSyncJob(
+        status='queued',
+        max_conversations=max_conversations,
+        max_messages=max_messages_per_conversation,
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    app = current_app._get_current_object()
+    # No trigger: APScheduler runs the job once, as soon as a worker thread is free
+    get_scheduler().add_job(
+        _run_sync_job,
+        args=[app, job.id],
+        id=f'dm_sync_{job.id}',
+        replace_existing=True,
+    )
+    return job
+
+
+def enqueue_dm_sync_from_form(form):
+    """Queue a DM sync using the limits posted by the sync buttons (50 each by default)."""
+    return enqueue_dm_sync(
+        max_conversations=int(form.get('max_conversations', 50)),
+        max_messages_per_conversation=int(form.get('max_messages', 50)),
+    )
+
+
+def _run_sync_job(app, job_id):
+    """Scheduler entry point: run one DM sync and store its summary on the job row."""
+    from .. import db
+    from ..models import DMSyncJob
+
+    with app.app_context():
+        job = DMSyncJob.query.get(job_id)
+        if not job:
+            return
+        job.status = 'running'
+        job.started_at = datetime.utcnow()
+        db.session.commit()
+
+        try:
+            summary = sync_previous_instagram_dms(
+                max_conversations=job.max_conversations,
+                max_messages_per_conversation=job.max_messages,
+            )
+            job.status = 'completed'
+            job.conversations_fetched = summary['conversations_fetched']
+            job.conversations_created = summary['conversations_created']
+            job.messages_created = summary['messages_created']
+            job.messages_skipped = summary['messages_skipped_existing']
+        except InstagramGraphPermissionError as e:
+            db.session.rollback()
+            job.status = 'failed'
+            job.error_message = READ_MAILBOX_ERROR if e.required_permission == 'read_mailbox' else str(e)
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f'DM sync job {job_id} failed: {e}')
+            job.status = 'failed'
+            job.error_message = str(e)
+
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
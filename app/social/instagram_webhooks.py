@@ -3,15 +3,129 @@ Instagram Webhook Handler for DM Automation
 Handles incoming webhook events from Instagram for direct messages
 """
 from flask import current_app, request
-import requests
+import atexit
 import json
+import logging
+import os
 import hmac
 import hashlib
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 import threading
+import types
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from sqlalchemy import func, insert, inspect, literal, select, union_all, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from .. import db
+from ..cache import TTLCache
+from ..models import DMConversation, DMMessage, WebhookInbox
+from ..ai.gemini_service import should_auto_reply, generate_fallback_response
+from .instagram import get_session
 
 API_BASE = 'https://graph.facebook.com/v19.0'
+GRAPH_MAX_IDS_PER_REQUEST = 50
+JSON_HEADERS = {'Content-Type': 'application/json'}
+SIGNATURE_HEADER_LENGTH = len('sha256=') + 64  # X-Hub-Signature-256: sha256=<hex digest>
+WEBHOOK_READ_CHUNK_SIZE = 64 * 1024
+# Meta sends Instagram messaging webhooks as object "instagram" or "page"
+WEBHOOK_OBJECT_TYPES = frozenset(('instagram', 'page'))
+
+# Incoming DMs are stored off the request thread so the webhook can 200 straight away.
+# Each sender's messages from a webhook run as one job, in order; different senders
+# in a batched webhook are processed in parallel.
+MESSAGE_WORKERS = 8
+_MESSAGE_EXECUTOR = ThreadPoolExecutor(max_workers=MESSAGE_WORKERS, thread_name_prefix='ig-webhook')
+
+# AI reply generation + outgoing sends; bounded so bursts queue instead of spawning threads
+REPLY_WORKERS = int(os.getenv('IG_REPLY_WORKERS', '8'))
+_REPLY_EXECUTOR = ThreadPoolExecutor(max_workers=REPLY_WORKERS, thread_name_prefix='ig-reply')
+# Past this many queued replies new ones are parked and re-queued by a scheduler sweep.
+# The slots count queued plus running replies and are freed by a done-callback.
+REPLY_BACKLOG_LIMIT = 200
+_REPLY_SLOTS = threading.BoundedSemaphore(REPLY_WORKERS + REPLY_BACKLOG_LIMIT)
+_DEFERRED_REPLIES = deque(maxlen=5000)
+
+# Text events are also written to the webhook_inbox table before they are queued,
+# so a restart can't lose them; rows still pending after this long are re-run
+INBOX_REPLAY_AFTER = timedelta(minutes=2)
+INBOX_RETENTION = timedelta(days=1)
+
+atexit.register(_MESSAGE_EXECUTOR.shutdown, wait=False)
+atexit.register(_REPLY_EXECUTOR.shutdown, wait=False)
+
+
+# Instagram user id -> username; usernames rarely change, so keep them for 6 hours
+USERNAME_CACHE_TTL_SECONDS = 6 * 3600
+_USERNAME_CACHE = TTLCache(maxsize=10000, ttl=USERNAME_CACHE_TTL_SECONDS)
+# Ids whose lookup just failed; kept briefly so retries don't hammer the Graph API
+_USERNAME_MISS_CACHE = TTLCache(maxsize=10000, ttl=60)
+
+# Recently seen message ids; drops Meta redeliveries without a DB round-trip.
+# The TTL covers Meta's retry window; the unique instagram_message_id column
+# still guards across restarts.
+_SEEN_MESSAGE_IDS = TTLCache(maxsize=50000, ttl=900)
+
+
+# Settings read on every webhook, bound once by init_instagram_webhooks()
+_CFG = None
+
+
+def _build_config(config):
+    business_id = config.get('INSTAGRAM_BUSINESS_ACCOUNT_ID')
+    app_secret_bytes = (config.get('INSTAGRAM_APP_SECRET') or '').encode('utf-8')
+    return types.SimpleNamespace(
+        app_secret=config.get('INSTAGRAM_APP_SECRET'),
+        app_secret_bytes=app_secret_bytes,
+        # Keyed once; streaming verification copy()s it instead of redoing the key schedule
+        hmac_template=hmac.new(app_secret_bytes, digestmod=hashlib.sha256) if app_secret_bytes else None,
+        access_token=config.get('INSTAGRAM_ACCESS_TOKEN'),
+        business_id=business_id,
+        verify_token=config.get('WEBHOOK_VERIFY_TOKEN'),
+        # Use the business account id for the messages endpoint; "me" fails for IG DMs.
+        messages_url=f"{API_BASE}/{business_id}/messages" if business_id else None,
+    )
+
+def init_instagram_webhooks(app):
+    """Bind the Instagram credentials used on the webhook hot path (called from create_app)"""
+    global _CFG
+    _CFG = _build_config(app.config)
+
+    from .. import get_scheduler
+    get_scheduler().add_job(
+        _replay_webhook_inbox,
+        'interval',
+        minutes=1,
+        args=[app],
+        id='replay_webhook_inbox',
+        replace_existing=True
+    )
+    get_scheduler().add_job(
+        _drain_deferred_replies,
+        'interval',
+        minutes=1,
+        args=[app],
+        id='drain_deferred_replies',
+        replace_existing=True
+    )
+
+def get_config():
+    """Startup-bound settings, or a fresh read of current_app.config if they were never bound"""
+    return _CFG if _CFG is not None else _build_config(current_app.config)
+
+def _parse_signature(signature):
+    """Return the raw digest from a 'sha256=<64 hex chars>' header, or None if malformed"""
+    if not signature or len(signature) != SIGNATURE_HEADER_LENGTH or not signature.startswith('sha256='):
+        return None
+    try:
+        return bytes.fromhex(signature[7:])
+    except ValueError:
+        return None
 
 def verify_webhook_signature(payload, signature):
     """
@@ -24,31 +138,65 @@ def verify_webhook_signature(payload, signature):
     Returns:
         bool: True if signature is valid
     """
-    app_secret = current_app.config.get('INSTAGRAM_APP_SECRET')
-    if not app_secret:
+    cfg = get_config()
+    if not cfg.app_secret:
         # If no app secret configured, skip verification (dev mode)
         current_app.logger.warning('INSTAGRAM_APP_SECRET not configured - skipping signature verification')
         return True
     
-    if not signature:
+    # A malformed header can never authenticate, so don't hash the body for it
+    provided_signature = _parse_signature(signature)
+    if provided_signature is None:
         return False
     
     try:
-        # Signature format: sha256=<signature>
-        method, signature_hash = signature.split('=')
-        
-        # Calculate expected signature
-        expected_signature = hmac.new(
-            app_secret.encode('utf-8'),
-            payload,
-            hashlib.sha256
-        ).hexdigest()
+        # One-shot C HMAC over the body with the secret encoded once at startup
+        expected_signature = hmac.digest(cfg.app_secret_bytes, payload, 'sha256')
         
-        return hmac.compare_digest(signature_hash, expected_signature)
+        # Compare the 32 raw digest bytes rather than 64-char hex strings
+        return hmac.compare_digest(provided_signature, expected_signature)
     except Exception as e:
         current_app.logger.error(f'Signature verification error: {e}')
         return False
 
+def verify_webhook_signature_stream(stream, signature, chunk_size=WEBHOOK_READ_CHUNK_SIZE):
+    """
+    Read a webhook body from a stream, hashing it chunk by chunk as it arrives
+    
+    Args:
+        stream: File-like request body (e.g. request.stream)
+        signature: X-Hub-Signature-256 header value
+        chunk_size: Bytes read per chunk
+    
+    Returns:
+        tuple: (bool valid, bytes body); body is None when the header is rejected
+        before anything is read
+    """
+    cfg = get_config()
+    mac = None
+    if cfg.app_secret:
+        provided_signature = _parse_signature(signature)
+        if provided_signature is None:
+            return False, None
+        mac = cfg.hmac_template.copy()
+    else:
+        # If no app secret configured, skip verification (dev mode)
+        current_app.logger.warning('INSTAGRAM_APP_SECRET not configured - skipping signature verification')
+    
+    chunks = []
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        if mac is not None:
+            mac.update(chunk)
+        chunks.append(chunk)
+    body = b''.join(chunks)
+    
+    if mac is None:
+        return True, body
+    return hmac.compare_digest(provided_signature, mac.digest()), body
+
 def handle_webhook_verification(verify_token, challenge):
     """
     Handle webhook verification request from Instagram
@@ -60,7 +208,7 @@ def handle_webhook_verification(verify_token, challenge):
     Returns:
         str: Challenge string if verification succeeds, None otherwise
     """
-    expected_token = current_app.config.get('WEBHOOK_VERIFY_TOKEN')
+    expected_token = get_config().verify_token
     
     if verify_token == expected_token:
         current_app.logger.info('Webhook verification successful')
@@ -70,22 +218,48 @@ def handle_webhook_verification(verify_token, challenge):
         return None
 
 
+@lru_cache(maxsize=4096)
+def _truncate_message_id(mid, max_length):
+    """Shorten an over-long id to max_length, keeping it unique via an MD5 suffix."""
+    # Use the first 16 hex chars of the hash to preserve uniqueness
+    hash_suffix = hashlib.md5(mid.encode()).hexdigest()[:16]
+    # Keep beginning + hash to stay under limit
+    prefix_len = max_length - 17  # -1 for dash separator
+    return mid[:prefix_len] + '-' + hash_suffix
+
 def _normalize_message_id(message_id, sender_id=None, timestamp=None, max_length=100):
     """Ensure instagram_message_id fits DB column (String(100))."""
     mid = str(message_id or '').strip()
     if not mid:
         mid = f"mid-{sender_id or 'unknown'}-{timestamp or int(time.time())}"
     
-    # If too long, hash it to preserve uniqueness
-    if len(mid) > max_length:
-        # Use last 16 chars of the hash to preserve uniqueness
-        import hashlib
-        hash_suffix = hashlib.md5(mid.encode()).hexdigest()[:16]
-        # Keep beginning + hash to stay under limit
-        prefix_len = max_length - 17  # -1 for dash separator
-        mid = mid[:prefix_len] + '-' + hash_suffix
-    
-    return mid
+    # Short ids pass straight through; long ones are hashed once per distinct id
+    if len(mid) <= max_length:
+        return mid
+    return _truncate_message_id(mid, max_length)
+
+def _truncated_json(obj, limit=2000):
+    """Serialize obj to JSON, stopping once limit characters have been produced"""
+    parts = []
+    size = 0
+    for part in json.JSONEncoder(default=str).iterencode(obj):
+        parts.append(part)
+        size += len(part)
+        if size >= limit:
+            break
+    return ''.join(parts)[:limit]
+
+def _event_time(timestamp):
+    """Convert a webhook epoch timestamp (ms, or s for some change events) to naive UTC"""
+    try:
+        ts = float(timestamp)
+    except (TypeError, ValueError):
+        return datetime.utcnow()
+    if ts <= 0:
+        return datetime.utcnow()
+    if ts > 1e11:  # milliseconds
+        ts /= 1000.0
+    return datetime.utcfromtimestamp(ts)
 
 def send_instagram_message(recipient_id, message_text):
     """
@@ -98,8 +272,9 @@ def send_instagram_message(recipient_id, message_text):
     Returns:
         dict: {'success': bool, 'message_id': str, 'error': str}
     """
-    token = current_app.config.get('INSTAGRAM_ACCESS_TOKEN')
-    business_id = current_app.config.get('INSTAGRAM_BUSINESS_ACCOUNT_ID')
+    cfg = get_config()
+    token = cfg.access_token
+    business_id = cfg.business_id
     
     if not token or not business_id:
         return {
@@ -108,8 +283,7 @@ def send_instagram_message(recipient_id, message_text):
             'error': 'Instagram credentials not configured'
         }
     
-    # Use the business account id for the messages endpoint; "me" fails for IG DMs.
-    endpoint = f"{API_BASE}/{business_id}/messages"
+    endpoint = cfg.messages_url
     
     payload = {
         'recipient': {'id': recipient_id},
@@ -118,19 +292,26 @@ def send_instagram_message(recipient_id, message_text):
     }
     
     try:
-        response = requests.post(endpoint, json=payload, timeout=30)
+        # Compact UTF-8 bytes: no padding spaces and no \u escapes for emoji/non-ASCII text
+        body = json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        response = get_session().post(endpoint, data=body, headers=JSON_HEADERS, timeout=30)
+        
+        # Parse the body once; error responses may not be JSON at all
+        try:
+            data = json.loads(response.content)
+        except ValueError:
+            data = {}
         
         if response.status_code == 200:
-            data = response.json()
             return {
                 'success': True,
                 'message_id': data.get('message_id'),
                 'error': None
             }
         else:
-            error_data = response.json() if response.headers.get('content-type', '').startswith('application/json') else {}
-            error_msg = error_data.get('error', {}).get('message', response.text)
-            error_code = error_data.get('error', {}).get('code')
+            error = data.get('error') or {}
+            error_msg = error.get('message') or response.text
+            error_code = error.get('code')
             
             # Special handling for permission error
             if error_code == 3 or 'does not have the capability' in error_msg:
@@ -154,198 +335,552 @@ def send_instagram_message(recipient_id, message_text):
             'error': str(e)
         }
 
-def get_instagram_username(instagram_user_id):
+CONVERSATION_STATUSES = ('active', 'resolved', 'archived')
+
+def send_manual_reply(conversation, message_text):
+    """
+    Send an operator's reply to a DM thread and record it in the history
+    The outgoing message is stored even when the send fails so the attempt
+    stays visible; the commit is left to the caller
+
+    Returns:
+        dict: send_instagram_message result
+    """
+    send_result = send_instagram_message(conversation.instagram_user_id, message_text)
+
+    message_id = _normalize_message_id(
+        send_result.get('message_id') or f"manual-{conversation.id}-{int(time.time())}",
+        sender_id=conversation.instagram_user_id,
+    )
+    db.session.add(DMMessage(
+        conversation_id=conversation.id,
+        instagram_message_id=message_id,
+        sender_type='bot',
+        message_text=message_text,
+        is_auto_reply=False,
+        sent_successfully=send_result.get('success', False),
+        error_message=send_result.get('error'),
+    ))
+
+    # Increment in SQL so a concurrent webhook bump isn't overwritten
+    conversation.message_count = func.coalesce(DMConversation.message_count, 0) + 1
+    conversation.last_message_at = datetime.utcnow()
+    return send_result
+
+def set_conversation_status(conversation_id, status):
+    """
+    Set a conversation's status with a single UPDATE; the commit is left to the caller
+
+    Returns:
+        bool: False when no conversation has that id
+
+    Raises:
+        ValueError: status is not one of CONVERSATION_STATUSES
+    """
+    if status not in CONVERSATION_STATUSES:
+        raise ValueError(f'Invalid conversation status: {status}')
+    # No need to load the whole row just to flip one column
+    updated = DMConversation.query.filter_by(id=conversation_id).update(
+        {'conversation_status': status}, synchronize_session=False
+    )
+    return bool(updated)
+
+def get_instagram_usernames_bulk(instagram_user_ids):
     """
-    Fetch Instagram username from user ID
+    Fetch usernames for several Instagram users with one Graph API multi-get
     
     Args:
-        instagram_user_id: Instagram PSID
+        instagram_user_ids: Iterable of Instagram PSIDs
     
     Returns:
-        str: Username or None
+        dict: {instagram_user_id: username} for every id that resolved
     """
-    token = current_app.config.get('INSTAGRAM_ACCESS_TOKEN')
+    usernames = {}
+    missing = []
+    for user_id in dict.fromkeys(instagram_user_ids):
+        cached = _USERNAME_CACHE.get(user_id)
+        if cached:
+            usernames[user_id] = cached
+        elif not _USERNAME_MISS_CACHE.get(user_id):
+            missing.append(user_id)
+    
+    if not missing:
+        return usernames
     
+    token = get_config().access_token
     if not token:
-        current_app.logger.warning('Cannot fetch username: INSTAGRAM_ACCESS_TOKEN not configured')
-        return None
+        current_app.logger.warning('Cannot fetch usernames: INSTAGRAM_ACCESS_TOKEN not configured')
+        return usernames
     
+    # Graph API multi-get accepts at most 50 ids per request
+    for start in range(0, len(missing), GRAPH_MAX_IDS_PER_REQUEST):
+        batch = missing[start:start + GRAPH_MAX_IDS_PER_REQUEST]
+        try:
+            response = get_session().get(
+                f"{API_BASE}/",
+                params={
+                    'ids': ','.join(batch),
+                    'fields': 'name,username',
+                    'access_token': token
+                },
+                timeout=10
+            )
+            if response.status_code != 200:
+                current_app.logger.warning(f'Failed to fetch usernames for {len(batch)} users: {response.text}')
+                continue
+            for user_id, profile in (json.loads(response.content) or {}).items():
+                username = (profile or {}).get('username') or (profile or {}).get('name')
+                if username:
+                    usernames[user_id] = username
+                    _USERNAME_CACHE.set(user_id, username)
+        except Exception as e:
+            current_app.logger.error(f'Error fetching usernames for {len(batch)} users: {e}')
+    
+    for user_id in missing:
+        if user_id not in usernames:
+            _USERNAME_MISS_CACHE.set(user_id, True)
+    
+    return usernames
+
+def _store_usernames(sender_ids):
+    """Look up usernames for the senders and fill them in where still missing"""
     try:
-        endpoint = f"{API_BASE}/{instagram_user_id}"
-        params = {
-            'fields': 'name,username,profile_pic',
-            'access_token': token
-        }
-        
-        response = requests.get(endpoint, params=params, timeout=10)
-        
-        if response.status_code == 200:
-            data = response.json()
-            username = data.get('username') or data.get('name')
-            if username:
-                current_app.logger.info(f'Fetched username for {instagram_user_id}: {username}')
-            return username
-        else:
-            error_data = response.json() if response.headers.get('content-type', '').startswith('application/json') else {}
-            error_msg = error_data.get('error', {}).get('message', response.text)
-            current_app.logger.warning(f'Failed to fetch username for {instagram_user_id}: {error_msg}')
-            return None
+        usernames = get_instagram_usernames_bulk(sender_ids)
+        for sender_id, username in usernames.items():
+            DMConversation.query.filter_by(instagram_user_id=sender_id, instagram_username=None).update(
+                {'instagram_username': username}, synchronize_session=False
+            )
+        db.session.commit()
     except Exception as e:
-        current_app.logger.error(f'Error fetching username for {instagram_user_id}: {e}')
-        return None
+        current_app.logger.error(f'Username lookup error for {len(sender_ids)} senders: {e}')
+        db.session.rollback()
 
-def process_instagram_message(sender_id, message_id, message_text, timestamp):
+# Engine URL -> whether dm_conversation.instagram_user_id has a unique index
+_UPSERT_SUPPORT = {}
+
+
+def _has_unique_user_index():
+    """Check (once per engine) that the conversation upsert has a conflict target"""
+    key = str(db.engine.url)
+    supported = _UPSERT_SUPPORT.get(key)
+    if supported is None:
+        try:
+            inspector = inspect(db.engine)
+            unique_sets = [c['column_names'] for c in inspector.get_unique_constraints('dm_conversation')]
+            unique_sets += [i['column_names'] for i in inspector.get_indexes('dm_conversation') if i.get('unique')]
+            supported = ['instagram_user_id'] in unique_sets
+        except Exception as e:
+            current_app.logger.warning(f'Could not inspect dm_conversation indexes: {e}')
+            supported = False
+        _UPSERT_SUPPORT[key] = supported
+    return supported
+
+def _upsert_conversation(sender_id, seen_at, count=1):
     """
-    Process incoming Instagram DM and generate auto-reply
+    Find or create the sender's conversation and count ``count`` new incoming messages
+    
+    Uses a single INSERT ... ON CONFLICT / ON DUPLICATE KEY UPDATE when the
+    unique index on instagram_user_id exists, otherwise SELECT then INSERT.
+    
+    Returns:
+        int: DMConversation id
+    """
+    table = DMConversation.__table__
+    values = {
+        'instagram_user_id': sender_id,
+        'platform': 'instagram',
+        'last_message_at': seen_at,
+        'message_count': count,
+        'auto_reply_count': 0,
+        'unread_count': count,
+    }
+    # Column references resolve to the existing row in both upsert forms
+    bump = {
+        'last_message_at': seen_at,
+        'message_count': func.coalesce(table.c.message_count, 0) + count,
+        'unread_count': func.coalesce(table.c.unread_count, 0) + count,
+    }
+
+    dialect = db.engine.dialect.name
+    if _has_unique_user_index():
+        if dialect == 'mysql':
+            # MySQL has no RETURNING; LAST_INSERT_ID(id) makes lastrowid report
+            # the existing row when the insert turns into an update
+            stmt = mysql_insert(table).values(**values).on_duplicate_key_update(
+                id=func.last_insert_id(table.c.id), **bump
+            )
+            return db.session.execute(stmt).lastrowid
+        if dialect in ('postgresql', 'sqlite'):
+            dialect_insert = postgresql_insert if dialect == 'postgresql' else sqlite_insert
+            stmt = dialect_insert(table).values(**values).on_conflict_do_update(
+                index_elements=['instagram_user_id'], set_=bump
+            ).returning(table.c.id)
+            return db.session.execute(stmt).scalar_one()
+
+    conversation_id = db.session.execute(
+        db.select(DMConversation.id).filter_by(instagram_user_id=sender_id).limit(1)
+    ).scalar()
+    if conversation_id is None:
+        conversation = DMConversation(**values)
+        db.session.add(conversation)
+        db.session.flush()
+        return conversation.id
+    db.session.execute(update(DMConversation).where(DMConversation.id == conversation_id).values(**bump))
+    return conversation_id
+
+def _send_reply(app_obj, conversation_id, sender_id, message_text):
+    """Reply worker: generate an AI response, send it and record the outgoing message"""
+    with app_obj.app_context():
+        try:
+            if not db.session.query(
+                db.exists().where(DMConversation.id == conversation_id)
+            ).scalar():
+                app_obj.logger.warning('Async reply: conversation missing')
+                return
+            # End the read-only transaction so the pooled connection isn't held
+            # through the multi-second Gemini and Graph API calls below
+            db.session.rollback()
+
+            # Use new RAG system for response generation. Imported here so the
+            # langchain/Pinecone stack only loads once a reply is generated
+            try:
+                from ..ai.rag_chat import generate_dm_response
+                reply_text = generate_dm_response(
+                    message=message_text,
+                    conversation_id=str(sender_id)
+                )
+                app_obj.logger.info(f"RAG response generated: {reply_text[:50]}...")
+            except Exception as rag_error:
+                app_obj.logger.error(f"RAG generation error: {rag_error}")
+                # Fallback to simple greeting
+                reply_text = generate_fallback_response()
+
+            send_result = send_instagram_message(sender_id, reply_text)
+
+            sent = bool(send_result.get('success'))
+            db.session.execute(insert(DMMessage).values(
+                conversation_id=conversation_id,
+                instagram_message_id=send_result.get('message_id'),
+                sender_type='bot',
+                message_text=reply_text,
+                is_auto_reply=True,
+                gemini_prompt_used=None,  # RAG system doesn't expose prompts
+                gemini_response_time=None,  # RAG handles timing internally
+                sent_successfully=sent,
+                error_message=send_result.get('error'),
+            ))
+
+            # Bump counters in SQL rather than read-modify-write on a loaded row
+            db.session.execute(
+                update(DMConversation)
+                .where(DMConversation.id == conversation_id)
+                .values(
+                    message_count=func.coalesce(DMConversation.message_count, 0) + 1,
+                    auto_reply_count=func.coalesce(DMConversation.auto_reply_count, 0) + (1 if sent else 0),
+                )
+            )
+
+            db.session.commit()
+        except Exception as e:
+            app_obj.logger.error(f'Async auto-reply error: {e}')
+            try:
+                db.session.rollback()
+            except Exception:
+                pass
+
+def _release_reply_slot(_future):
+    _REPLY_SLOTS.release()
+
+def _try_submit_reply(app_obj, conversation_id, sender_id, message_text):
+    """Submit to the reply pool if a backlog slot is free; False when it is full"""
+    if not _REPLY_SLOTS.acquire(blocking=False):
+        return False
+    try:
+        future = _REPLY_EXECUTOR.submit(_send_reply, app_obj, conversation_id, sender_id, message_text)
+    except Exception:
+        _REPLY_SLOTS.release()
+        raise
+    future.add_done_callback(_release_reply_slot)
+    return True
+
+def _queue_reply(app_obj, conversation_id, sender_id, message_text):
+    """
+    Hand a reply to the reply pool, or park it when the pool is backed up
+    
+    Returns:
+        bool: True if queued now, False if deferred to the sweep job
+    """
+    if _try_submit_reply(app_obj, conversation_id, sender_id, message_text):
+        return True
+    app_obj.logger.warning(f'Reply backlog full; deferring reply to {sender_id}')
+    _DEFERRED_REPLIES.append((conversation_id, sender_id, message_text))
+    return False
+
+def _drain_deferred_replies(app_obj):
+    """Scheduler job: move parked replies back onto the pool once the backlog clears"""
+    while _DEFERRED_REPLIES:
+        try:
+            reply = _DEFERRED_REPLIES.popleft()
+        except IndexError:
+            break
+        if not _try_submit_reply(app_obj, *reply):
+            # Still full; put it back at the front for the next sweep
+            _DEFERRED_REPLIES.appendleft(reply)
+            break
+
+def process_instagram_messages(sender_id, messages, stored=()):
+    """
+    Store several incoming DMs from one sender in one transaction, then queue replies
     
     Args:
         sender_id: Instagram PSID of the sender
-        message_id: Instagram message ID
-        message_text: The message content
-        timestamp: Message timestamp (milliseconds)
+        messages: List of (message_id, message_text, timestamp) in delivery order;
+            message ids must already be normalized
+        stored: Message ids known to be in the database already
     
     Returns:
-        dict: Processing result
+        list: One processing result per message
     """
-    from .. import db
-    from ..models import DMConversation, DMMessage
-    from ..ai.rag_chat import generate_dm_response
-    
-    current_app.logger.info(f'Processing message from {sender_id}: {message_text[:50]}...')
+    duplicate = {'success': True, 'replied': False, 'reason': 'duplicate_message'}
+    results = []
+    fresh = []
+    for message_id, message_text, timestamp in messages:
+        if message_id in stored or not _SEEN_MESSAGE_IDS.add(message_id):
+            current_app.logger.info(f"Skip duplicate message_id={message_id}")
+            results.append(duplicate)
+        else:
+            fresh.append((message_id, message_text, timestamp))
+    if not fresh:
+        return results
     
     try:
-        # Find or create conversation
-        conversation = DMConversation.query.filter_by(instagram_user_id=sender_id).first()
-        
-        if not conversation:
-            # New conversation - get username
-            username = get_instagram_username(sender_id)
-            conversation = DMConversation(
-                instagram_user_id=sender_id,
-                instagram_username=username,
-                platform='instagram',
-                message_count=0,
-                auto_reply_count=0
-            )
-            db.session.add(conversation)
-            db.session.flush()  # Get ID
-        
-        # Normalize message id to fit DB constraint
-        message_id = _normalize_message_id(message_id, sender_id=sender_id, timestamp=timestamp)
-
-        # Skip duplicates if already stored
-        if DMMessage.query.filter_by(instagram_message_id=message_id).first():
-            current_app.logger.info(f"Skip duplicate message_id={message_id}")
-            return {
-                'success': True,
-                'replied': False,
-                'reason': 'duplicate_message',
+        # One conversation upsert counting every message, one multi-row INSERT, one commit
+        seen_at = max(_event_time(timestamp) for _, _, timestamp in fresh)
+        conversation_id = _upsert_conversation(sender_id, seen_at, count=len(fresh))
+        db.session.execute(insert(DMMessage), [
+            {
+                'conversation_id': conversation_id,
+                'instagram_message_id': message_id,
+                'sender_type': 'user',
+                'message_text': message_text,
+                'is_auto_reply': False,
             }
-
-        # Save incoming message
-        incoming_msg = DMMessage(
-            conversation_id=conversation.id,
-            instagram_message_id=message_id,
-            sender_type='user',
-            message_text=message_text,
-            is_auto_reply=False
-        )
-        db.session.add(incoming_msg)
-        
-        # Update conversation
-        conversation.last_message_at = datetime.utcnow()
-        conversation.message_count += 1
-        # Increment unread count if column exists
-        try:
-            conversation.unread_count = (conversation.unread_count or 0) + 1
-        except AttributeError:
-            pass  # Column doesn't exist yet
-        
+            for message_id, message_text, _ in fresh
+        ])
         db.session.commit()
-        
-        # Check if we should auto-reply using ChatSettings
-        from ..models import ChatSettings
-        from ..ai.gemini_service import should_auto_reply
-        
+    except Exception as e:
+        current_app.logger.error(f'Error storing {len(fresh)} messages from {sender_id}: {e}')
+        db.session.rollback()
+        # Let a redelivery retry messages that failed to store
+        for message_id, _, _ in fresh:
+            _SEEN_MESSAGE_IDS.pop(message_id)
+        return results + [{'success': False, 'replied': False, 'error': str(e)}] * len(fresh)
+    
+    # Replies are only queued once every message is committed
+    conversation = db.session.get(DMConversation, conversation_id)
+    app_obj = current_app._get_current_object()
+    for _, message_text, _ in fresh:
         should_reply, reason = should_auto_reply(message_text, conversation)
         if not should_reply:
             current_app.logger.info(f'Not replying: {reason}')
-            return {
-                'success': True,
-                'replied': False,
-                'reason': reason,
-            }
+            results.append({'success': True, 'replied': False, 'reason': reason})
+        elif _queue_reply(app_obj, conversation_id, sender_id, message_text):
+            results.append({'success': True, 'replied': True, 'reason': 'Queued auto-reply'})
+        else:
+            results.append({'success': True, 'replied': False, 'reason': 'Reply deferred (worker backlog)'})
+    return results
 
-        app_obj = current_app._get_current_object()
-        conversation_id = conversation.id
+def _iter_text_messages(messaging):
+    """
+    Yield (sender_id, timestamp, message) for each incoming message in a messaging[] list
+    
+    Reactions/reads carry no message dict and echoes are our own outgoing
+    messages, so both are skipped here; the text checks happen in the caller.
+    """
+    for ev in messaging:
+        message = ev.get('message')
+        if isinstance(message, dict) and not message.get('is_echo'):
+            yield (ev.get('sender') or {}).get('id'), ev.get('timestamp'), message
 
-        def _send_reply_async():
-            from .. import db as _db
-            from ..models import DMConversation as _DMConversation, DMMessage as _DMMessage
+def _append_event(out, now_ts, sender_id, message_text, timestamp=None, message_id=None, source=None):
+    """Append one extracted text event to ``out`` unless it lacks a sender or text"""
+    if not sender_id:
+        current_app.logger.info('Skip event: missing sender_id')
+        return
+    if not message_text:
+        current_app.logger.info('Skip event: empty message_text')
+        return
+    # Fallback message id to avoid None/dup issues
+    mid = message_id or f"auto-{timestamp or now_ts}-{sender_id}"
+    out.append((sender_id, timestamp, mid, message_text, source))
 
-            with app_obj.app_context():
-                try:
-                    conv = _DMConversation.query.get(conversation_id)
-                    if not conv:
-                        app_obj.logger.warning('Async reply: conversation missing')
-                        return
+def _extract_text_events(entry_obj):
+    """
+    Return the text messages in one webhook entry as a list of
+    (sender_id, timestamp, message_id, message_text, source) tuples
+    """
+    extracted = []
+    messaging = entry_obj.get('messaging')
+    changes = entry_obj.get('changes')
+    if not isinstance(messaging, list) and not isinstance(changes, list):
+        # Nothing that can carry a text message (reads, reactions, ...)
+        return extracted
 
-                    # Use new RAG system for response generation
-                    try:
-                        reply_text = generate_dm_response(
-                            message=message_text,
-                            conversation_id=str(sender_id)
-                        )
-                        app_obj.logger.info(f"RAG response generated: {reply_text[:50]}...")
-                    except Exception as rag_error:
-                        app_obj.logger.error(f"RAG generation error: {rag_error}")
-                        # Fallback to simple greeting
-                        from ..ai.gemini_service import generate_fallback_response
-                        reply_text = generate_fallback_response()
-
-                    send_result = send_instagram_message(sender_id, reply_text)
-
-                    outgoing_msg = _DMMessage(
-                        conversation_id=conv.id,
-                        instagram_message_id=send_result.get('message_id'),
-                        sender_type='bot',
-                        message_text=reply_text,
-                        is_auto_reply=True,
-                        gemini_prompt_used=None,  # RAG system doesn't expose prompts
-                        gemini_response_time=None,  # RAG handles timing internally
-                        sent_successfully=send_result.get('success', False),
-                        error_message=send_result.get('error'),
-                    )
-                    _db.session.add(outgoing_msg)
-
-                    conv.message_count = (conv.message_count or 0) + 1
-                    if send_result.get('success'):
-                        conv.auto_reply_count = (conv.auto_reply_count or 0) + 1
-
-                    _db.session.commit()
-                except Exception as e:
-                    app_obj.logger.error(f'Async auto-reply error: {e}')
-                    try:
-                        _db.session.rollback()
-                    except Exception:
-                        pass
+    # One clock read per entry for any events that arrive without a timestamp
+    now_ts = time.time()
 
-        threading.Thread(target=_send_reply_async, daemon=True).start()
+    # 1) Standard: entry.messaging[]
+    if isinstance(messaging, list):
+        for sender_id, timestamp, message in _iter_text_messages(messaging):
+            _append_event(extracted, now_ts, sender_id, message.get('text') or '', timestamp=timestamp,
+                           message_id=message.get('mid') or message.get('id'), source='entry.messaging')
 
-        return {
-            'success': True,
-            'replied': True,
-            'reason': 'Queued auto-reply',
-        }
+    # 2) Alternate: entry.changes[].value.*
+    if isinstance(changes, list):
+        for change in changes:
+            value = change.get('value') or {}
+
+            # 2a) value.messaging[]
+            value_messaging = value.get('messaging')
+            if isinstance(value_messaging, list):
+                for sender_id, timestamp, message in _iter_text_messages(value_messaging):
+                    _append_event(extracted, now_ts, sender_id, message.get('text') or '', timestamp=timestamp,
+                                   message_id=message.get('mid') or message.get('id'), source='changes.messaging')
+
+            # 2b) Some integrations deliver a single message-like object in value
+            # Try common fields: value.from.id + value.message/text
+            from_obj = value.get('from')
+            sender_id = from_obj.get('id') if isinstance(from_obj, dict) else None
+            message_text = value.get('message') or value.get('text')
+            if sender_id and isinstance(message_text, str):
+                message_text = message_text.strip()
+                if message_text:
+                    _append_event(extracted, now_ts, sender_id, message_text,
+                                   timestamp=value.get('timestamp') or value.get('time'),
+                                   message_id=value.get('id'), source='changes.value')
+
+    return extracted
+
+def _store_events(app_obj, events):
+    """
+    Store a batch of text events in order and queue their replies
     
+    Meta's retries are harmless: ids seen by this process are skipped up
+    front, ids already in dm_message are found by one batched lookup, and
+    the unique instagram_message_id column still guards across restarts.
+    """
+    # Redeliveries of ids this process just handled never reach the database
+    pending = []
+    for ev in events:
+        sender_id, timestamp, message_id = ev[0], ev[1], ev[2]
+        message_id = _normalize_message_id(message_id, sender_id=sender_id, timestamp=timestamp)
+        if _SEEN_MESSAGE_IDS.get(message_id):
+            app_obj.logger.info(f"Skip redelivered message_id={message_id}")
+            continue
+        pending.append((ev, message_id))
+    if not pending:
+        return
+
+    sender_ids = {ev[0] for ev, _ in pending}
+    message_ids = [message_id for _, message_id in pending]
+
+    # One round-trip for the whole batch: which senders already have a
+    # conversation (the rest get a batched username lookup) and which
+    # message ids are already stored (skipped as duplicates)
+    rows = db.session.execute(union_all(
+        select(literal('conversation').label('kind'), DMConversation.instagram_user_id.label('key'))
+        .where(DMConversation.instagram_user_id.in_(sender_ids)),
+        select(literal('message'), DMMessage.instagram_message_id)
+        .where(DMMessage.instagram_message_id.in_(message_ids)),
+    )).all()
+    known = {key for kind, key in rows if kind == 'conversation'}
+    stored = {key for kind, key in rows if kind == 'message'}
+
+    # Each sender's messages are written in a single transaction
+    by_sender = {}
+    for (sender_id, timestamp, _, message_text, _), message_id in pending:
+        by_sender.setdefault(sender_id, []).append((message_id, message_text, timestamp))
+    for sender_id, messages in by_sender.items():
+        try:
+            process_instagram_messages(sender_id, messages, stored=stored)
+        except Exception as e:
+            app_obj.logger.error(f"Error processing {len(messages)} events from {sender_id}: {e}")
+
+    new_sender_ids = sender_ids - known
+    if new_sender_ids:
+        _store_usernames(list(new_sender_ids))
+
+def _enqueue_inbox(batches):
+    """Persist event batches to the webhook inbox; returns their row ids (None if unavailable)"""
+    try:
+        rows = [
+            WebhookInbox(events=json.dumps(batch, separators=(',', ':'), ensure_ascii=False))
+            for batch in batches
+        ]
+        db.session.add_all(rows)
+        db.session.commit()
+        return [row.id for row in rows]
     except Exception as e:
-        current_app.logger.error(f'Error processing message: {e}')
+        # Still process in memory; only crash durability is lost
+        current_app.logger.error(f'Could not write webhook inbox: {e}')
         db.session.rollback()
-        return {
-            'success': False,
-            'replied': False,
-            'error': str(e)
-        }
+        return [None] * len(batches)
+
+def _process_events(app_obj, events, inbox_id=None):
+    """Worker entry point: store one batch and mark its inbox row processed"""
+    with app_obj.app_context():
+        status, error = 'done', None
+        try:
+            _store_events(app_obj, events)
+        except Exception as e:
+            app_obj.logger.error(f'Background webhook processing error: {e}')
+            db.session.rollback()
+            status, error = 'failed', str(e)[:500]
+
+        if inbox_id is None:
+            return
+        try:
+            db.session.execute(
+                update(WebhookInbox)
+                .where(WebhookInbox.id == inbox_id)
+                .values(status=status, error_message=error, processed_at=datetime.utcnow())
+            )
+            db.session.commit()
+        except Exception as e:
+            app_obj.logger.error(f'Could not update webhook inbox row {inbox_id}: {e}')
+            db.session.rollback()
+
+def _replay_webhook_inbox(app_obj):
+    """Scheduler job: re-queue inbox rows a restart left pending and prune old processed rows"""
+    with app_obj.app_context():
+        try:
+            now = datetime.utcnow()
+            # SKIP LOCKED lets concurrent replayers claim disjoint rows; pushing
+            # received_at forward keeps a row that is still waiting in the pool
+            # from being queued again on the next sweep
+            stale = WebhookInbox.query.filter(
+                WebhookInbox.status == 'pending',
+                WebhookInbox.received_at < now - INBOX_REPLAY_AFTER
+            ).order_by(WebhookInbox.id).limit(100).with_for_update(skip_locked=True).all()
+            if stale:
+                db.session.execute(
+                    update(WebhookInbox)
+                    .where(WebhookInbox.id.in_([row.id for row in stale]))
+                    .values(received_at=now)
+                )
+                db.session.commit()
+            for row in stale:
+                app_obj.logger.info(f'Replaying webhook inbox row {row.id}')
+                _MESSAGE_EXECUTOR.submit(_process_events, app_obj, json.loads(row.events), row.id)
+
+            WebhookInbox.query.filter(
+                WebhookInbox.status != 'pending',
+                WebhookInbox.processed_at < now - INBOX_RETENTION
+            ).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            app_obj.logger.error(f'Webhook inbox replay error: {e}')
+            db.session.rollback()
 
 def handle_webhook_event(event_data):
     """
@@ -379,84 +914,46 @@ def handle_webhook_event(event_data):
         # Meta can send Instagram messaging webhooks with object "instagram" or "page"
         # depending on how the subscription is configured.
         obj_type = event_data.get('object')
-        if obj_type not in {'instagram', 'page'}:
+        if obj_type not in WEBHOOK_OBJECT_TYPES:
             current_app.logger.info(f"Webhook object '{obj_type}' received; attempting to parse anyway")
         
+        entries = event_data.get('entry') or []
+        if not entries:
+            return {
+                'success': True,
+                'processed': 0,
+                'results': []
+            }
+        
         results = []
-        current_app.logger.info(f"Webhook payload received: {json.dumps(event_data)[:2000]}")
+        if current_app.logger.isEnabledFor(logging.DEBUG):
+            current_app.logger.debug('Webhook payload received: %s', _truncated_json(event_data, 2000))
         
-        def _extract_text_events(entry_obj):
-            """Return a list of normalized events: {sender_id, timestamp, message_id, message_text}."""
-            extracted = []
-
-            def _add(sender_id, message_text, timestamp=None, message_id=None, source=None):
-                if not sender_id:
-                    current_app.logger.info('Skip event: missing sender_id')
-                    return
-                if not message_text:
-                    current_app.logger.info('Skip event: empty message_text')
-                    return
-                # Fallback message id to avoid None/dup issues
-                mid = message_id or f"auto-{timestamp or datetime.utcnow().timestamp()}-{sender_id}"
-                extracted.append({
-                    'sender_id': sender_id,
-                    'timestamp': timestamp,
-                    'message_id': mid,
-                    'message_text': message_text,
-                    'source': source,
-                })
-
-            # 1) Standard: entry.messaging[]
-            for ev in (entry_obj.get('messaging') or []) if isinstance(entry_obj.get('messaging'), list) else []:
-                sender_id = (ev.get('sender') or {}).get('id')
-                timestamp = ev.get('timestamp')
-                message = ev.get('message')
-                if isinstance(message, dict):
-                    message_id = message.get('mid') or message.get('id')
-                    message_text = message.get('text') or ''
-                    _add(sender_id, message_text, timestamp=timestamp, message_id=message_id, source='entry.messaging')
-
-            # 2) Alternate: entry.changes[].value.*
-            for change in (entry_obj.get('changes') or []) if isinstance(entry_obj.get('changes'), list) else []:
-                value = change.get('value') or {}
-
-                # 2a) value.messaging[]
-                if isinstance(value.get('messaging'), list):
-                    for ev in value.get('messaging') or []:
-                        sender_id = (ev.get('sender') or {}).get('id')
-                        timestamp = ev.get('timestamp')
-                        message = ev.get('message')
-                        if isinstance(message, dict):
-                            message_id = message.get('mid') or message.get('id')
-                            message_text = message.get('text') or ''
-                            _add(sender_id, message_text, timestamp=timestamp, message_id=message_id, source='changes.messaging')
-
-                # 2b) Some integrations deliver a single message-like object in value
-                # Try common fields: value.from.id + value.message/text
-                sender_id = None
-                from_obj = value.get('from')
-                if isinstance(from_obj, dict):
-                    sender_id = from_obj.get('id')
-                message_text = value.get('message') or value.get('text')
-                if sender_id and isinstance(message_text, str) and message_text.strip():
-                    _add(sender_id, message_text.strip(), timestamp=value.get('timestamp') or value.get('time'), message_id=value.get('id'), source='changes.value')
-
-            return extracted
-
-        for entry in event_data.get('entry', []) or []:
-            extracted = _extract_text_events(entry)
-            current_app.logger.info(f"Extracted {len(extracted)} text events from entry")
+        extracted_by_entry = [_extract_text_events(entry) for entry in entries]
+        
+        # Hand the text events to the worker pool, one job per sender so that
+        # senders run in parallel; the reply to Meta doesn't wait on the DB or AI
+        # Redeliveries of messages already handled (or repeated within this
+        # payload) are dropped here, before they cost an inbox row
+        events_by_sender = {}
+        batch_ids = set()
+        for extracted in extracted_by_entry:
             for ev in extracted:
-                try:
-                    result = process_instagram_message(
-                        ev['sender_id'],
-                        ev.get('message_id'),
-                        ev.get('message_text') or '',
-                        ev.get('timestamp'),
-                    )
-                    results.append(result)
-                except Exception as e:
-                    current_app.logger.error(f"Error processing extracted event from {ev.get('source')}: {e}")
+                message_id = _normalize_message_id(ev[2], sender_id=ev[0], timestamp=ev[1])
+                if message_id in batch_ids or _SEEN_MESSAGE_IDS.get(message_id):
+                    continue
+                batch_ids.add(message_id)
+                events_by_sender.setdefault(ev[0], []).append(ev)
+        if events_by_sender:
+            # One durable inbox INSERT on the request path; the rest runs in the pool
+            batches = list(events_by_sender.values())
+            app_obj = current_app._get_current_object()
+            for batch, inbox_id in zip(batches, _enqueue_inbox(batches)):
+                _MESSAGE_EXECUTOR.submit(_process_events, app_obj, batch, inbox_id)
+        queued = sum(len(sender_events) for sender_events in events_by_sender.values())
+        
+        for entry, extracted in zip(entries, extracted_by_entry):
+            current_app.logger.info(f"Extracted {len(extracted)} text events from entry")
             
             # NEW: Handle comment events for automation
             changes = entry.get('changes', [])
@@ -500,12 +997,13 @@ def handle_webhook_event(event_data):
                             'error': str(comment_err)
                         })
 
-        if not results:
+        if not results and not queued:
             current_app.logger.info('No processable messaging events found in webhook payload')
         
         return {
             'success': True,
-            'processed': len(results),
+            'processed': len(results) + queued,
+            'queued': queued,
             'results': results
         }
     
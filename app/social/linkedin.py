@@ -1,9 +1,23 @@
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
 from flask import current_app
 
 API_BASE = 'https://api.linkedin.com/v2'
 
+# Shared session so LinkedIn calls reuse pooled keep-alive connections.
+# Retries only apply to idempotent methods, so posts are never duplicated.
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504]),
+))
+
+# LinkedIn allows up to 10 images per post; each one is uploaded on its own thread
+MAX_IMAGE_UPLOAD_WORKERS = 10
+
 def check_linkedin_account_status():
     """Check if LinkedIn credentials are valid and return account info"""
     token = current_app.config.get('LINKEDIN_ACCESS_TOKEN')
@@ -19,8 +33,8 @@ def check_linkedin_account_status():
     try:
         # Verify token by getting user info
         headers = {'Authorization': f'Bearer {token}'}
-        response = requests.get(
-            'https://api.linkedin.com/v2/me',
+        response = _SESSION.get(
+            f'{API_BASE}/me',
             headers=headers,
             timeout=10
         )
@@ -60,6 +74,39 @@ def check_linkedin_account_status():
             'message': str(e)
         }
 
+def _upload_image(img_path, owner, token):
+    """Register an image upload for owner, PUT the file to it and return the asset URN"""
+    register_body = {
+        "registerUploadRequest": {
+            "recipes": ["urn:li:digitalmediaRecipe:feedshare-image"],
+            "owner": owner,
+            "serviceRelationships": [{
+                "relationshipType": "OWNER",
+                "identifier": "urn:li:userGeneratedContent"
+            }]
+        }
+    }
+    headers = {'Authorization': f'Bearer {token}'}
+    resp = _SESSION.post(f"{API_BASE}/assets?action=registerUpload", json=register_body, headers=headers, timeout=30)
+    if resp.status_code >= 300:
+        raise RuntimeError(f'LinkedIn image register failed (HTTP {resp.status_code}): {resp.text}')
+    value = resp.json().get('value', {})
+    upload_url = value.get('uploadMechanism', {}).get(
+        'com.linkedin.digitalmedia.uploading.MediaUploadHttpRequest', {}
+    ).get('uploadUrl')
+    asset = value.get('asset')
+    if not upload_url or not asset:
+        raise RuntimeError(f'LinkedIn image register returned no upload URL. Response: {value}')
+
+    # Send bytes, not the open file: _SESSION retries PUT on 502/503/504, and a
+    # retry would resend an already-consumed stream as an empty/truncated image
+    with open(img_path, 'rb') as fh:
+        image_bytes = fh.read()
+    upload_resp = _SESSION.put(upload_url, data=image_bytes, headers=headers, timeout=60)
+    if upload_resp.status_code >= 300:
+        raise RuntimeError(f'LinkedIn image upload failed (HTTP {upload_resp.status_code}): {upload_resp.text}')
+    return asset
+
 def post_to_linkedin(post):
     token = current_app.config.get('LINKEDIN_ACCESS_TOKEN')
     org_id = current_app.config.get('LINKEDIN_ORGANIZATION_ID')
@@ -67,20 +114,19 @@ def post_to_linkedin(post):
         raise ValueError('LinkedIn access token not configured. Please set LINKEDIN_ACCESS_TOKEN in config.')
 
     headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'}
+    author = f"urn:li:organization:{org_id}" if org_id else f"urn:li:person:me"
     
     # Parse image paths if available
-    image_paths = []
-    if post.image_path:
-        try:
-            image_paths = json.loads(post.image_path) if post.image_path.startswith('[') else [post.image_path]
-        except (json.JSONDecodeError, AttributeError):
-            image_paths = [post.image_path] if post.image_path else []
+    try:
+        image_paths = post.image_paths
+    except ValueError:
+        image_paths = [post.image_path]
     
     # Post with or without images
     if not image_paths:
         # Text-only post
         body = {
-            "author": f"urn:li:organization:{org_id}" if org_id else f"urn:li:person:me",
+            "author": author,
             "lifecycleState": "PUBLISHED",
             "specificContent": {
                 "com.linkedin.ugc.ShareContent": {
@@ -91,21 +137,29 @@ def post_to_linkedin(post):
             "visibility": {"com.linkedin.ugc.MemberNetworkVisibility": "PUBLIC"}
         }
     else:
-        # Post with images (requires image upload flow - simplified here)
-        # In production, you'd upload images first and get media URNs
-        media_items = []
-        for img_path in image_paths[:10]:  # LinkedIn supports up to 10 images
-            # Simplified: In real implementation, upload each image to LinkedIn's upload API
-            # and get the digitalmediaAsset URN, then add to media array
-            media_items.append({
-                "status": "READY",
-                "description": {"text": "Image"},
-                "media": f"urn:li:digitalmediaAsset:placeholder_{img_path}",
-                "title": {"text": "Image"}
-            })
+        image_paths = image_paths[:10]  # LinkedIn supports up to 10 images
+
+        # Each upload is an independent register + PUT round-trip, so run them
+        # concurrently; map() keeps the asset URNs in image order.
+        workers = min(MAX_IMAGE_UPLOAD_WORKERS, len(image_paths))
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                assets = list(executor.map(
+                    lambda path: _upload_image(path, author, token),
+                    image_paths,
+                ))
+        except requests.exceptions.RequestException as e:
+            raise RuntimeError(f'LinkedIn image upload request failed: {str(e)}')
+
+        media_items = [{
+            "status": "READY",
+            "description": {"text": "Image"},
+            "media": asset,
+            "title": {"text": "Image"}
+        } for asset in assets]
         
         body = {
-            "author": f"urn:li:organization:{org_id}" if org_id else f"urn:li:person:me",
+            "author": author,
             "lifecycleState": "PUBLISHED",
             "specificContent": {
                 "com.linkedin.ugc.ShareContent": {
@@ -118,7 +172,7 @@ def post_to_linkedin(post):
         }
     
     try:
-        resp = requests.post(f"{API_BASE}/ugcPosts", json=body, headers=headers, timeout=30)
+        resp = _SESSION.post(f"{API_BASE}/ugcPosts", json=body, headers=headers, timeout=30)
         if resp.status_code >= 300:
             error_data = resp.json() if resp.headers.get('content-type', '').startswith('application/json') else {'message': resp.text}
             error_msg = error_data.get('message', error_data.get('error', resp.text))
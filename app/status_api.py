@@ -2,12 +2,280 @@
 Flask route to serve System Status Monitor data
 Add this to app/routes.py or create app/status_routes.py
 """
-from flask import Blueprint, jsonify, render_template, current_app
-from datetime import datetime
+from flask import Blueprint, jsonify, render_template, current_app, request
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as ProbeTimeout
+from functools import lru_cache
+import atexit
+import gzip
+import os
+import threading
+import time
+from sqlalchemy import case, func, select
+from config import Config
+from . import db
+from .cache import TTLCache
 from .auth import login_required
+from .models import AutomationLog, ScheduledPost, WebhookInbox, parse_image_paths
 
 status_bp = Blueprint('status', __name__)
 
+# The status widget polls every few seconds; each metric is cached for its own
+# TTL so Pinecone and the DB are hit at most once per window, not per poll.
+DB_METRICS_TTL_SECONDS = 10
+EXAMPLE_UPLOAD_TTL_SECONDS = 60
+PINECONE_METRICS_TTL_SECONDS = 60
+_METRICS_CACHE = TTLCache(maxsize=16, ttl=DB_METRICS_TTL_SECONDS)  # per-key ttl passed on store
+
+# The DB and Pinecone probes run side by side; a probe that overruns its
+# timeout reports degraded and keeps running to refill the cache for later polls.
+# Each dependency has its own worker and at most one probe in flight, so a hung
+# Pinecone call can't queue up and starve the DB probe.
+DB_PROBE_TIMEOUT_SECONDS = 1
+PINECONE_PROBE_TIMEOUT_SECONDS = 2
+_PROBE_EXECUTORS = {
+    key: ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'status-probe-{key}')
+    for key in ('db', 'pinecone')
+}
+_INFLIGHT_PROBES = {}
+_PROBE_LOCK = threading.Lock()
+for _executor in _PROBE_EXECUTORS.values():
+    atexit.register(_executor.shutdown, wait=False)
+
+# The assembled payload is served stale-while-revalidate: polls within the TTL
+# get the cached dict, and the first poll after it starts a background refresh
+STATUS_TTL_SECONDS = 10
+_STATUS_CACHE = TTLCache(maxsize=1, ttl=STATUS_TTL_SECONDS)
+
+# Automation success rate and last trigger are taken over this window
+AUTOMATION_WINDOW = timedelta(hours=24)
+_DB_METRICS_DOWN = {
+    'status': 'degraded', 'latency_ms': None, 'connections': None, 'jobs_queued': 0,
+    'next_post_at': None, 'last_event_at': None, 'last_automation_at': None,
+    'automation_success': None,
+}
+
+# Polled JSON is gzipped for clients that accept it; tiny bodies aren't worth it
+COMPRESS_MIN_SIZE = 200
+COMPRESS_LEVEL = 6
+
+@status_bp.after_request
+def _gzip_json(response):
+    """Gzip JSON responses from this blueprint when the client accepts it"""
+    if (response.mimetype != 'application/json' or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or 'gzip' not in request.headers.get('Accept-Encoding', '').lower()):
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+    response.set_data(gzip.compress(body, compresslevel=COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+@lru_cache(maxsize=1)
+def _configured_services():
+    """(groq, pinecone, gemini, instagram) configured flags; Config is fixed after import"""
+    groq_configured = bool(Config.GROQ_API_KEY and Config.GROQ_API_KEY.strip() and Config.GROQ_API_KEY != 'your_groq_api_key_here')
+    pinecone_configured = bool(Config.PINECONE_API_KEY and Config.PINECONE_API_KEY.strip() and Config.PINECONE_API_KEY != 'your_pinecone_api_key_here')
+    gemini_configured = bool(Config.GEMINI_API_KEY and Config.GEMINI_API_KEY.strip())
+    instagram_configured = bool(Config.INSTAGRAM_ACCESS_TOKEN and Config.INSTAGRAM_ACCESS_TOKEN.strip())
+    return groq_configured, pinecone_configured, gemini_configured, instagram_configured
+
+def _probe(app_obj, key, ttl, compute):
+    """Probe-pool entry point: a cached metric read inside an app context"""
+    with app_obj.app_context():
+        return _METRICS_CACHE.get_or_set(key, compute, ttl=ttl)
+
+def _submit_probe(app_obj, key, ttl, compute):
+    """Start the probe for key on its own worker, or join the one still running"""
+    with _PROBE_LOCK:
+        future = _INFLIGHT_PROBES.get(key)
+        if future is None or future.done():
+            future = _PROBE_EXECUTORS[key].submit(_probe, app_obj, key, ttl, compute)
+            _INFLIGHT_PROBES[key] = future
+        return future
+
+def _probe_result(future, timeout, fallback):
+    """Wait up to timeout seconds for a probe, returning fallback if it overruns"""
+    try:
+        return future.result(timeout=timeout)
+    except ProbeTimeout:
+        return fallback
+
+def _db_metrics():
+    """Scheduler queue, webhook and automation figures plus the measured query latency"""
+    try:
+        started = time.perf_counter()
+        # One index-only pass over (status, scheduled_time) for both the queue
+        # size and the next due post
+        jobs_queued, next_post_at = db.session.execute(
+            select(func.count(), func.min(ScheduledPost.scheduled_time))
+            .where(ScheduledPost.status == 'scheduled')
+        ).one()
+        latency_ms = (time.perf_counter() - started) * 1000
+
+        last_event_at = db.session.execute(select(func.max(WebhookInbox.received_at))).scalar()
+        last_automation_at, automations, automations_ok = db.session.execute(
+            select(
+                func.max(AutomationLog.created_at),
+                func.count(),
+                func.sum(case((AutomationLog.success == True, 1), else_=0)),
+            ).where(AutomationLog.created_at >= datetime.utcnow() - AUTOMATION_WINDOW)
+        ).one()
+        pool = db.engine.pool
+        return {
+            'status': 'operational',
+            'latency_ms': latency_ms,
+            'connections': pool.checkedout() if hasattr(pool, 'checkedout') else None,
+            'jobs_queued': jobs_queued,
+            'next_post_at': next_post_at,
+            'last_event_at': last_event_at,
+            'last_automation_at': last_automation_at,
+            'automation_success': (automations_ok or 0) / automations if automations else None,
+        }
+    except Exception:
+        return dict(_DB_METRICS_DOWN)
+
+def _pinecone_metrics():
+    """(pinecone_status, vector_count, latency_ms) from the RAG index stats"""
+    try:
+        from .ai.rag_chat import get_chat_pipeline
+        chat_pipeline = get_chat_pipeline()
+        started = time.perf_counter()
+        index_stats = chat_pipeline.vector_store._index.describe_index_stats()
+        latency_ms = (time.perf_counter() - started) * 1000
+        return 'operational', f"{index_stats.get('total_vector_count', 0):,}", latency_ms
+    except:
+        return 'degraded', 'N/A', None
+
+def _latest_upload_filename():
+    """Filename of the newest scheduled post's first image, or None"""
+    try:
+        # Only the one column, newest by primary key (no sort on created_at)
+        raw = db.session.execute(
+            select(ScheduledPost.image_path)
+            .where(ScheduledPost.image_path.isnot(None))
+            .order_by(ScheduledPost.id.desc())
+            .limit(1)
+        ).scalar()
+        if not raw:
+            return None
+        try:
+            paths = parse_image_paths(raw)
+        except ValueError:
+            paths = [raw]
+        return os.path.basename(paths[0]) if paths else None
+    except Exception:
+        return None
+
+def _format_ms(ms):
+    return f'{ms:.0f}ms' if ms is not None else 'N/A'
+
+def _format_ago(moment, now):
+    """'42s ago' / '5m ago' / '3h ago' for a past UTC datetime, 'N/A' when unknown"""
+    if moment is None:
+        return 'N/A'
+    seconds = max(0, int((now - moment).total_seconds()))
+    if seconds < 60:
+        return f'{seconds}s ago'
+    if seconds < 3600:
+        return f'{seconds // 60}m ago'
+    return f'{seconds // 3600}h ago'
+
+def _format_until(moment, now):
+    """'15m' / '2h' until a future UTC datetime, 'due' once it has passed"""
+    if moment is None:
+        return 'N/A'
+    seconds = int((moment - now).total_seconds())
+    if seconds <= 0:
+        return 'due'
+    if seconds < 3600:
+        return f'{max(1, seconds // 60)}m'
+    return f'{seconds // 3600}h'
+
+def _build_system_status(app_obj):
+    """Measure every service once and return the widget payload"""
+    groq_configured, pinecone_configured, gemini_configured, instagram_configured = _configured_services()
+
+    # Start the DB and Pinecone probes together so the slower one sets the latency
+    db_future = _submit_probe(app_obj, 'db', DB_METRICS_TTL_SECONDS, _db_metrics)
+    pinecone_future = None
+    if pinecone_configured and gemini_configured:
+        pinecone_future = _submit_probe(
+            app_obj, 'pinecone', PINECONE_METRICS_TTL_SECONDS, _pinecone_metrics
+        )
+
+    # Database metrics
+    db_metrics = _probe_result(db_future, DB_PROBE_TIMEOUT_SECONDS, _DB_METRICS_DOWN)
+    db_status = db_metrics['status']
+
+    # Pinecone metrics
+    pinecone_status = 'down' if not pinecone_configured else 'operational'
+    vector_count = '0'
+    pinecone_latency_ms = None
+    if pinecone_future is not None:
+        pinecone_status, vector_count, pinecone_latency_ms = _probe_result(
+            pinecone_future, PINECONE_PROBE_TIMEOUT_SECONDS, ('degraded', 'N/A', None)
+        )
+
+    # Figures nothing in the app measures (third-party quotas and model
+    # latencies) are reported as N/A rather than made up
+    now = datetime.utcnow()
+    success_rate = db_metrics['automation_success']
+    connections = db_metrics['connections']
+    return {
+        # When these figures were measured; the response 'timestamp' is set per request
+        'generatedAt': datetime.now().isoformat(),
+        'instaGraphApi': {
+            'status': 'operational' if instagram_configured else 'down',
+            'latency': 'N/A',
+            'rateLimitRemaining': 'N/A'
+        },
+        'webhooksConfig': {
+            'status': 'operational' if instagram_configured else 'down',
+            'activeHooks': 3 if instagram_configured else 0,
+            'lastEvent': _format_ago(db_metrics['last_event_at'], now)
+        },
+        'sqlDatabase': {
+            'status': db_status,
+            'activeConnections': connections if connections is not None else 'N/A',
+            'latency': _format_ms(db_metrics['latency_ms'])
+        },
+        'groqCloud': {
+            'status': 'operational' if groq_configured else 'down',
+            'model': 'llama-3.1-70b',
+            'latency': 'N/A'
+        },
+        'pinecone': {
+            'status': pinecone_status,
+            'index': 'social-vectors',
+            'totalVectors': vector_count,
+            'latency': _format_ms(pinecone_latency_ms)
+        },
+        'scheduler': {
+            'status': db_status,
+            'jobsQueued': db_metrics['jobs_queued'],
+            'nextRun': _format_until(db_metrics['next_post_at'], now)
+        },
+        'automation': {
+            'status': 'operational' if (db_status == 'operational' and instagram_configured) else 'degraded',
+            'lastTriggered': _format_ago(db_metrics['last_automation_at'], now),
+            'successRate': f'{success_rate:.0%}' if success_rate is not None else 'N/A'
+        },
+        'geminiApi': {
+            'status': 'operational' if gemini_configured else 'down',
+            'latency': 'N/A',
+            'quotaUsedToday': 'N/A'
+        },
+        'llumaAi': {
+            'status': 'operational',
+            'latency': 'N/A',
+            'modelVersion': 'v2.3.1'
+        }
+    }
+
 @status_bp.route('/workflow-status')
 @login_required
 def workflow_status():
@@ -34,90 +302,14 @@ def get_system_status():
     Returns data for all 9 services in the architecture.
     """
     try:
-        from config import Config
-        from . import db
-        from .models import ScheduledPost
-        import random
-        
-        # Check API configurations
-        groq_configured = bool(Config.GROQ_API_KEY and Config.GROQ_API_KEY.strip() and Config.GROQ_API_KEY != 'your_groq_api_key_here')
-        pinecone_configured = bool(Config.PINECONE_API_KEY and Config.PINECONE_API_KEY.strip() and Config.PINECONE_API_KEY != 'your_pinecone_api_key_here')
-        gemini_configured = bool(Config.GEMINI_API_KEY and Config.GEMINI_API_KEY.strip())
-        instagram_configured = bool(Config.INSTAGRAM_ACCESS_TOKEN and Config.INSTAGRAM_ACCESS_TOKEN.strip())
-        
-        # Database metrics
-        db_status = 'operational'
-        jobs_queued = 0
-        db_connections = random.randint(8, 15)
-        try:
-            jobs_queued = ScheduledPost.query.filter_by(status='scheduled').count()
-        except Exception as e:
-            db_status = 'degraded'
+        app_obj = current_app._get_current_object()
+        # The first poll measures inline (concurrent first polls share the
+        # per-metric caches, so they don't multiply the probes); later ones get
+        # the last payload while a background thread remeasures
+        data = _STATUS_CACHE.get_or_revalidate('system', lambda: _build_system_status(app_obj))
         
-        # Pinecone metrics
-        pinecone_status = 'down' if not pinecone_configured else 'operational'
-        vector_count = '0'
-        if pinecone_configured and gemini_configured:
-            try:
-                from .ai.rag_chat import get_chat_pipeline
-                chat_pipeline = get_chat_pipeline()
-                index_stats = chat_pipeline.vector_store._index.describe_index_stats()
-                vector_count = f"{index_stats.get('total_vector_count', 0):,}"
-                pinecone_status = 'operational'
-            except:
-                pinecone_status = 'degraded'
-                vector_count = 'N/A'
-        
-        # Return comprehensive status data
-        return jsonify({
-            'timestamp': datetime.now().isoformat(),
-            'instaGraphApi': {
-                'status': 'operational' if instagram_configured else 'down',
-                'latency': f'{random.randint(120, 200)}ms',
-                'rateLimitRemaining': f'{random.randint(75, 95)}%'
-            },
-            'webhooksConfig': {
-                'status': 'operational' if instagram_configured else 'down',
-                'activeHooks': 3 if instagram_configured else 0,
-                'lastEvent': f'{random.randint(2, 30)}m ago'
-            },
-            'sqlDatabase': {
-                'status': db_status,
-                'activeConnections': db_connections,
-                'latency': f'{random.randint(5, 15)}ms'
-            },
-            'groqCloud': {
-                'status': 'operational' if groq_configured else 'down',
-                'model': 'llama-3.1-70b',
-                'latency': f'{random.randint(200, 350)}ms'
-            },
-            'pinecone': {
-                'status': pinecone_status,
-                'index': 'social-vectors',
-                'totalVectors': vector_count,
-                'latency': f'{random.randint(30, 80)}ms'
-            },
-            'scheduler': {
-                'status': db_status,
-                'jobsQueued': jobs_queued,
-                'nextRun': f'{random.randint(5, 45)}m'
-            },
-            'automation': {
-                'status': 'operational' if (db_status == 'operational' and instagram_configured) else 'degraded',
-                'lastTriggered': f'{random.randint(3, 20)}m ago',
-                'successRate': f'{random.randint(88, 98)}%'
-            },
-            'geminiApi': {
-                'status': 'operational' if gemini_configured else 'down',
-                'latency': f'{random.randint(150, 280)}ms',
-                'quotaUsedToday': f'{random.randint(15, 45)}%'
-            },
-            'llumaAi': {
-                'status': 'operational',
-                'latency': f'{random.randint(120, 220)}ms',
-                'modelVersion': 'v2.3.1'
-            }
-        })
+        # Copy so the shared cached payload isn't mutated
+        return jsonify(dict(data, timestamp=datetime.now().isoformat()))
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -126,7 +318,6 @@ def get_system_status():
 def config_check():
     """Basic configuration check useful after deployment."""
     try:
-        from .models import ScheduledPost
         public_url = current_app.config.get('PUBLIC_URL', '')
         upload_folder = current_app.config.get('UPLOAD_FOLDER', '')
         is_https = public_url.lower().startswith('https://') if public_url else False
@@ -135,20 +326,8 @@ def config_check():
         insta_bid = bool(current_app.config.get('INSTAGRAM_BUSINESS_ACCOUNT_ID'))
 
         # Provide an example upload URL if a scheduled post has images
-        example_upload_url = None
-        try:
-            last_with_image = ScheduledPost.query.filter(ScheduledPost.image_path.isnot(None)).order_by(ScheduledPost.created_at.desc()).first()
-            if last_with_image and last_with_image.image_path:
-                import json, os
-                try:
-                    paths = json.loads(last_with_image.image_path) if last_with_image.image_path.startswith('[') else [last_with_image.image_path]
-                except Exception:
-                    paths = [last_with_image.image_path]
-                if paths:
-                    filename = os.path.basename(paths[0])
-                    example_upload_url = f"{public_url}/uploads/{filename}" if public_url else None
-        except Exception:
-            example_upload_url = None
+        example_filename = _METRICS_CACHE.get_or_set('example_upload', _latest_upload_filename, ttl=EXAMPLE_UPLOAD_TTL_SECONDS)
+        example_upload_url = f"{public_url}/uploads/{example_filename}" if public_url and example_filename else None
 
         return jsonify({
             'public_url': public_url,
@@ -6,11 +6,54 @@ Helper utilities for media URLs and downloads.
 """
 
 import os
-import mimetypes
+import re
 from datetime import datetime
 from typing import Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Pooled keep-alive connections for repeat downloads from the same hosts.
+# GET is idempotent, so transient gateway errors are retried.
+_SESSION = requests.Session()
+_RETRY = Retry(total=2, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+_SESSION.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=64, max_retries=_RETRY))
+_SESSION.mount('http://', HTTPAdapter(pool_connections=16, pool_maxsize=64, max_retries=_RETRY))
+
+# Bytes copied per read/write; 64 KiB keeps syscalls per image low
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Share-link hosts, matched in one scan; see _DIRECT_URL_HANDLERS
+_PROVIDER_RE = re.compile(r'drive\.google\.com|dropbox\.com|onedrive\.live\.com|1drv\.ms')
+_DRIVE_FILE_RE = re.compile(r'/file/d/([^/]*)')
+_DRIVE_ID_RE = re.compile(r'id=([^&]*)')
+
+
+def _drive_direct_url(url):
+    # Extract file ID from various Google Drive URL formats
+    match = _DRIVE_FILE_RE.search(url) or _DRIVE_ID_RE.search(url)
+    if not match:
+        return url
+    return f'https://drive.google.com/uc?export=download&id={match.group(1)}'
+
+
+def _dropbox_direct_url(url):
+    return url.replace('www.dropbox.com', 'dl.dropboxusercontent.com').replace('?dl=0', '?dl=1')
+
+
+def _onedrive_direct_url(url):
+    # OneDrive requires more complex handling
+    return url.replace('view.aspx', 'download.aspx')
+
+
+_DIRECT_URL_HANDLERS = {
+    'drive.google.com': _drive_direct_url,
+    'dropbox.com': _dropbox_direct_url,
+    'onedrive.live.com': _onedrive_direct_url,
+    '1drv.ms': _onedrive_direct_url,
+}
+
 
 def convert_to_direct_url(url):
     """
@@ -22,30 +65,33 @@ def convert_to_direct_url(url):
     - OneDrive
     - Direct URLs
     """
-    
-    # Google Drive
-    if 'drive.google.com' in url:
-        # Extract file ID from various Google Drive URL formats
-        if '/file/d/' in url:
-            file_id = url.split('/file/d/')[1].split('/')[0]
-        elif 'id=' in url:
-            file_id = url.split('id=')[1].split('&')[0]
-        else:
-            return url
-        return f'https://drive.google.com/uc?export=download&id={file_id}'
-    
-    # Dropbox
-    elif 'dropbox.com' in url:
-        return url.replace('www.dropbox.com', 'dl.dropboxusercontent.com').replace('?dl=0', '?dl=1')
-    
-    # OneDrive
-    elif 'onedrive.live.com' in url or '1drv.ms' in url:
-        # OneDrive requires more complex handling
-        return url.replace('view.aspx', 'download.aspx')
-    
-    # Already a direct URL
-    else:
+    match = _PROVIDER_RE.search(url)
+    if not match:
+        # Already a direct URL
         return url
+    return _DIRECT_URL_HANDLERS[match.group(0)](url)
+
+
+# Image formats accepted from remote URLs, keyed by their leading magic bytes
+_IMAGE_MAGIC = (
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'GIF87a', '.gif'),
+    (b'GIF89a', '.gif'),
+)
+
+# Larger downloads are rejected before (or while) they reach the disk
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+
+
+def _sniff_image_ext(head: bytes) -> Optional[str]:
+    """Return the file extension for an image's first bytes, or None if unrecognised"""
+    for magic, ext in _IMAGE_MAGIC:
+        if head.startswith(magic):
+            return ext
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp'
+    return None
 
 
 def download_image_to_uploads(image_url: str, upload_folder: str) -> Optional[str]:
@@ -53,8 +99,9 @@ def download_image_to_uploads(image_url: str, upload_folder: str) -> Optional[st
     Download an image from a URL into the upload folder and return the full path.
 
     - Converts common share URLs (Drive/Dropbox/OneDrive) to direct links
-    - Validates that the response looks like an image
-    - Picks a reasonable file extension
+    - Validates that the response looks like an image (header and magic bytes)
+    - Rejects bodies larger than MAX_IMAGE_BYTES
+    - Picks the file extension from the image's actual format
     """
     if not image_url:
         return None
@@ -63,32 +110,57 @@ def download_image_to_uploads(image_url: str, upload_folder: str) -> Optional[st
 
     direct_url = convert_to_direct_url(image_url.strip())
     try:
-        resp = requests.get(direct_url, timeout=15, stream=True)
+        resp = _SESSION.get(direct_url, headers={'Accept': 'image/*'}, timeout=15, stream=True)
         resp.raise_for_status()
     except Exception:
         return None
 
-    content_type = resp.headers.get('Content-Type', '')
-    if not content_type.startswith('image/'):
-        return None
-
-    # Determine extension from content-type or URL
-    ext = mimetypes.guess_extension(content_type.split(';')[0].strip()) or ''
-    if not ext:
-        # Try from URL path
-        guessed = os.path.splitext(direct_url.split('?')[0])[1]
-        ext = guessed if guessed else '.jpg'
-
-    filename = datetime.utcnow().strftime('%Y%m%d%H%M%S_') + 'remote' + ext
-    full_path = os.path.join(upload_folder, filename)
-
-    try:
-        with open(full_path, 'wb') as f:
-            for chunk in resp.iter_content(chunk_size=8192):
-                if chunk:
+    # The with block returns the connection to the pool on every exit path
+    with resp:
+        content_type = resp.headers.get('Content-Type', '')
+        if not content_type.startswith('image/'):
+            return None
+        try:
+            if int(resp.headers.get('Content-Length') or 0) > MAX_IMAGE_BYTES:
+                return None
+        except ValueError:
+            return None
+
+        try:
+            # decode_content undoes any gzip/deflate transfer encoding
+            resp.raw.decode_content = True
+            head = resp.raw.read(16)
+        except Exception:
+            return None
+        # The bytes decide the format; a header or URL suffix can disagree with them
+        ext = _sniff_image_ext(head)
+        if not ext:
+            return None
+
+        filename = datetime.utcnow().strftime('%Y%m%d%H%M%S_') + 'remote' + ext
+        full_path = os.path.join(upload_folder, filename)
+
+        try:
+            # Copy from the socket in large chunks, stopping at the size cap
+            # (Content-Length can be missing or wrong)
+            written = len(head)
+            with open(full_path, 'wb') as f:
+                f.write(head)
+                while True:
+                    chunk = resp.raw.read(DOWNLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    if written > MAX_IMAGE_BYTES:
+                        raise ValueError('image exceeds MAX_IMAGE_BYTES')
                     f.write(chunk)
-    except Exception:
-        return None
+        except Exception:
+            # Don't leave a truncated image behind
+            try:
+                os.remove(full_path)
+            except OSError:
+                pass
+            return None
 
     return full_path
 
@@ -2,8 +2,10 @@
 Webhook Routes for Instagram DM Integration
 Handles webhook verification and incoming webhook events
 """
+import json
+
 from flask import Blueprint, request, jsonify, current_app
-from .social.instagram_webhooks import handle_webhook_verification, handle_webhook_event, verify_webhook_signature
+from .social.instagram_webhooks import handle_webhook_verification, handle_webhook_event, verify_webhook_signature_stream
 
 webhook_bp = Blueprint('webhook', __name__, url_prefix='/webhook')
 
@@ -35,21 +37,30 @@ def instagram_webhook():
         # Webhook event
         signature = request.headers.get('X-Hub-Signature-256', '')
         
+        # Hash the body while reading it off the stream; the same bytes then feed
+        # the JSON parser, and a malformed header is rejected before any read
+        valid, raw_body = verify_webhook_signature_stream(request.stream, signature)
+        
         # Verify signature
-        if not verify_webhook_signature(request.get_data(), signature):
+        if not valid:
             current_app.logger.warning('Invalid webhook signature')
             return 'Invalid signature', 403
         
         # Process event
         try:
-            event_data = request.get_json()
-            current_app.logger.info(f'Received webhook event: {event_data}')
+            event_data = json.loads(raw_body)
+            # Log the raw bytes we already hold instead of repr()-ing the parsed dict
+            current_app.logger.info('Received webhook event: %s', raw_body[:2000].decode('utf-8', 'replace'))
 
-            # Process immediately so incoming DMs are stored right away.
-            # Any slow work (AI reply / outgoing message) is handled asynchronously inside the handler.
+            # Messages are queued to a worker pool inside the handler, so this
+            # returns before any DB writes, AI generation or outgoing sends.
             result = handle_webhook_event(event_data)
-            current_app.logger.info(f'Webhook processed: {result}')
-            return jsonify({'status': 'received', 'processed': result.get('processed', 0)}), 200
+            current_app.logger.info('Webhook processed: %s', result)
+            return jsonify({
+                'status': 'received',
+                'processed': result.get('processed', 0),
+                'queued': result.get('queued', 0),
+            }), 200
         
         except Exception as e:
             current_app.logger.error(f'Webhook processing error: {e}')
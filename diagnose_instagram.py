@@ -6,6 +6,7 @@ Tests the complete flow to identify where the problem is
 import os
 import sys
 import requests
+from requests.adapters import HTTPAdapter
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -23,6 +24,10 @@ def test_instagram_publishing():
     warnings = []
     success_checks = []
     
+    # One session for every probe so the Graph API steps share a keep-alive connection
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=4))
+    
     # 1. Check Credentials
     print("\n✓ STEP 1: Checking Instagram Credentials")
     print("-" * 80)
@@ -67,14 +72,14 @@ def test_instagram_publishing():
     uploads_folder = os.path.join(os.path.dirname(__file__), 'uploads')
     
     if os.path.exists(uploads_folder):
-        files = [f for f in os.listdir(uploads_folder) if os.path.isfile(os.path.join(uploads_folder, f))]
+        # scandir's entries answer is_file() from the directory listing itself
+        with os.scandir(uploads_folder) as entries:
+            files = [entry for entry in entries if entry.is_file()]
         if files:
             success_checks.append(f"✓ Uploads folder exists with {len(files)} file(s)")
             print(f"Files in uploads folder:")
-            for f in files[:5]:  # Show first 5 files
-                file_path = os.path.join(uploads_folder, f)
-                file_size = os.path.getsize(file_path)
-                print(f"  - {f} ({file_size} bytes)")
+            for entry in files[:5]:  # Show first 5 files
+                print(f"  - {entry.name} ({entry.stat().st_size} bytes)")
         else:
             warnings.append("⚠️ Uploads folder is empty")
     else:
@@ -92,7 +97,7 @@ def test_instagram_publishing():
         print(f"Testing URL: {test_url}")
         
         try:
-            response = requests.head(test_url, timeout=10, allow_redirects=True)
+            response = session.head(test_url, timeout=10, allow_redirects=True)
             print(f"Response Status: {response.status_code}")
             
             if response.status_code < 500:
@@ -113,7 +118,7 @@ def test_instagram_publishing():
             api_url = f"https://graph.facebook.com/v19.0/{business_id}"
             print(f"Testing: {api_url}")
             
-            response = requests.get(
+            response = session.get(
                 api_url,
                 params={
                     'fields': 'id,username,name',
@@ -157,7 +162,7 @@ def test_instagram_publishing():
                 'access_token': access_token
             }
             
-            response = requests.post(media_endpoint, data=test_data, timeout=30)
+            response = session.post(media_endpoint, data=test_data, timeout=30)
             
             if response.status_code == 200:
                 success_checks.append("✓ Can create media in Instagram (test passed)")
@@ -20,6 +20,36 @@ with app.app_context():
         # Column might already exist or permissions issue
         print(f"Note: Could not add unread_count column (it may already exist): {e}")
 
+# Unique index on instagram_user_id lets the webhook upsert conversations in one statement
+with app.app_context():
+    try:
+        from sqlalchemy import inspect, text
+        inspector = inspect(db.engine)
+        unique_sets = [c['column_names'] for c in inspector.get_unique_constraints('dm_conversation')]
+        unique_sets += [i['column_names'] for i in inspector.get_indexes('dm_conversation') if i.get('unique')]
+        if ['instagram_user_id'] not in unique_sets:
+            with db.engine.connect() as conn:
+                conn.execute(text('CREATE UNIQUE INDEX uq_dm_conversation_instagram_user_id ON dm_conversation (instagram_user_id)'))
+                conn.commit()
+            print("✓ Added unique index on dm_conversation.instagram_user_id")
+    except Exception as e:
+        # Existing duplicate rows or permissions; the webhook falls back to SELECT + INSERT
+        print(f"Note: Could not add unique index on dm_conversation.instagram_user_id: {e}")
+
+# Index for counting queued posts and finding due ones without a table scan
+with app.app_context():
+    try:
+        from sqlalchemy import inspect, text
+        inspector = inspect(db.engine)
+        index_names = [i['name'] for i in inspector.get_indexes('scheduled_post')]
+        if 'ix_scheduled_post_status_time' not in index_names:
+            with db.engine.connect() as conn:
+                conn.execute(text('CREATE INDEX ix_scheduled_post_status_time ON scheduled_post (status, scheduled_time)'))
+                conn.commit()
+            print("✓ Added ix_scheduled_post_status_time index")
+    except Exception as e:
+        print(f"Note: Could not add scheduled_post status index (it may already exist): {e}")
+
 # Add automation tables for Automations Suite
 with app.app_context():
     try:
@@ -116,6 +146,23 @@ with app.app_context():
     except Exception as e:
         print(f"Note: Could not create automation tables (they may already exist): {e}")
 
+# Add automation_log indexes for the log list, stats and rate-limit queries
+with app.app_context():
+    try:
+        from sqlalchemy import inspect, text
+        inspector = inspect(db.engine)
+        index_names = [i['name'] for i in inspector.get_indexes('automation_log')]
+        with db.engine.connect() as conn:
+            if 'ix_automation_log_type_created' not in index_names:
+                conn.execute(text('CREATE INDEX ix_automation_log_type_created ON automation_log (automation_type, created_at)'))
+                print("✓ Added ix_automation_log_type_created index")
+            if 'ix_automation_log_created' not in index_names:
+                conn.execute(text('CREATE INDEX ix_automation_log_created ON automation_log (created_at)'))
+                print("✓ Added ix_automation_log_created index")
+            conn.commit()
+    except Exception as e:
+        print(f"Note: Could not add automation_log indexes (they may already exist): {e}")
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
@@ -0,0 +1,22 @@
+import os
+import tempfile
+
+import pytest
+
+# Config reads the environment once at import, so point it at a throwaway
+# SQLite database (and a known webhook secret) before the app is imported
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+os.environ['INSTAGRAM_APP_SECRET'] = 'test-app-secret'
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import create_app
+    app = create_app()
+    app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
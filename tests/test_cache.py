@@ -0,0 +1,131 @@
+"""
+Tests for the shared in-process TTLCache
+Run from the project root with: python -m pytest tests
+"""
+from app.cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def make_cache(maxsize=10, ttl=10):
+    clock = FakeClock()
+    return TTLCache(maxsize=maxsize, ttl=ttl, clock=clock), clock
+
+
+def test_entries_expire_after_ttl():
+    cache, clock = make_cache(ttl=10)
+    cache.set('a', 1)
+    clock.advance(9.9)
+    assert cache.get('a') == 1
+    clock.advance(0.1)
+    assert cache.get('a') is None
+    assert cache.get('a', 'missing') == 'missing'
+
+
+def test_set_with_per_entry_ttl():
+    cache, clock = make_cache(ttl=10)
+    cache.set('short', 1, ttl=2)
+    cache.set('default', 2)
+    clock.advance(5)
+    assert cache.get('short') is None
+    assert cache.get('default') == 2
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache, _ = make_cache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1  # 'b' is now the least recently used
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+
+def test_add_first_writer_wins_until_expiry():
+    cache, clock = make_cache(ttl=10)
+    assert cache.add('mid-1') is True
+    assert cache.add('mid-1') is False
+    clock.advance(10)
+    assert cache.add('mid-1') is True
+
+
+def test_pop_and_clear():
+    cache, _ = make_cache()
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.pop('a') == 1
+    assert cache.pop('a', 'gone') == 'gone'
+    cache.clear()
+    assert cache.get('b') is None
+
+
+def test_get_or_set_caches_none_results():
+    cache, clock = make_cache(ttl=10)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return None
+
+    assert cache.get_or_set('k', compute) is None
+    assert cache.get_or_set('k', compute) is None
+    assert len(calls) == 1
+    clock.advance(10)
+    cache.get_or_set('k', compute)
+    assert len(calls) == 2
+
+
+def test_get_or_revalidate_serves_stale_and_refreshes_once():
+    cache, clock = make_cache(ttl=10)
+    background = []
+    values = iter(['v1', 'v2'])
+
+    # Nothing cached: computed inline
+    assert cache.get_or_revalidate('k', lambda: next(values), background.append) == 'v1'
+    assert background == []
+
+    # Fresh: served from cache without a refresh
+    assert cache.get_or_revalidate('k', lambda: next(values), background.append) == 'v1'
+    assert background == []
+
+    # Expired: the stale value is returned and exactly one refresh is handed off
+    clock.advance(10)
+    assert cache.get_or_revalidate('k', lambda: next(values), background.append) == 'v1'
+    assert cache.get_or_revalidate('k', lambda: next(values), background.append) == 'v1'
+    assert len(background) == 1
+
+    # Once the refresh runs, the new value is served and refreshes can start again
+    assert background[0]() == 'v2'
+    assert cache.get_or_revalidate('k', lambda: next(values), background.append) == 'v2'
+    clock.advance(10)
+    cache.get_or_revalidate('k', lambda: 'v3', background.append)
+    assert len(background) == 2
+
+
+def test_get_or_revalidate_releases_refresh_after_failure():
+    cache, clock = make_cache(ttl=10)
+    background = []
+    cache.get_or_revalidate('k', lambda: 'v1', background.append)
+    clock.advance(10)
+
+    def boom():
+        raise RuntimeError('probe failed')
+
+    cache.get_or_revalidate('k', boom, background.append)
+    try:
+        background[0]()
+    except RuntimeError:
+        pass
+    # The failed refresh doesn't leave the key stuck as "refreshing"
+    assert cache.get_or_revalidate('k', lambda: 'v2', background.append) == 'v1'
+    assert len(background) == 2
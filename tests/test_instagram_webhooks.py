@@ -0,0 +1,231 @@
+"""
+Tests for the Instagram webhook pipeline: signature checks, message-id dedup,
+the durable webhook inbox (and its replay) and the conversation upsert
+Run from the project root with: python -m pytest tests
+"""
+import hashlib
+import hmac
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from app.models import DMConversation, DMMessage, WebhookInbox
+from app.social import instagram_webhooks
+
+SECRET = b'test-app-secret'
+
+
+def sign(body):
+    return 'sha256=' + hmac.new(SECRET, body, hashlib.sha256).hexdigest()
+
+
+def dm_payload(sender_id, *mids):
+    now_ms = int(time.time() * 1000)
+    return {
+        'object': 'instagram',
+        'entry': [{
+            'id': 'page-id',
+            'time': now_ms,
+            'messaging': [{
+                'sender': {'id': sender_id},
+                'recipient': {'id': 'page-id'},
+                'timestamp': now_ms,
+                'message': {'mid': mid, 'text': f'hello {mid}'},
+            } for mid in mids],
+        }],
+    }
+
+
+def post_webhook(client, payload, signature=None):
+    body = json.dumps(payload).encode('utf-8')
+    return client.post(
+        '/webhook/instagram',
+        data=body,
+        headers={'X-Hub-Signature-256': signature if signature is not None else sign(body)},
+        content_type='application/json',
+    )
+
+
+def wait_for_inbox(app, timeout=5):
+    """Block until the message pool has finished every pending inbox row"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with app.app_context():
+            if not WebhookInbox.query.filter_by(status='pending').count():
+                return
+        time.sleep(0.05)
+    raise AssertionError('webhook inbox rows still pending')
+
+
+def user_messages(app, sender_id):
+    with app.app_context():
+        return (
+            DMMessage.query.join(DMConversation)
+            .filter(DMConversation.instagram_user_id == sender_id, DMMessage.sender_type == 'user')
+            .count()
+        )
+
+
+@pytest.fixture
+def sender_id():
+    return f'psid-{uuid.uuid4().hex[:12]}'
+
+
+def test_messages_are_stored_and_inbox_marked_done(app, client, sender_id):
+    response = post_webhook(client, dm_payload(sender_id, f'mid-{sender_id}-1', f'mid-{sender_id}-2'))
+    assert response.status_code == 200
+    assert response.get_json()['queued'] == 2
+
+    wait_for_inbox(app)
+    assert user_messages(app, sender_id) == 2
+    with app.app_context():
+        conversation = DMConversation.query.filter_by(instagram_user_id=sender_id).one()
+        assert conversation.message_count == 2
+        assert conversation.unread_count == 2
+        assert WebhookInbox.query.filter_by(status='failed').count() == 0
+
+
+def test_redelivery_is_dropped(app, client, sender_id):
+    payload = dm_payload(sender_id, f'mid-{sender_id}-1')
+    assert post_webhook(client, payload).get_json()['queued'] == 1
+    wait_for_inbox(app)
+
+    # Meta retries the same delivery: dropped by the in-process seen-id cache
+    response = post_webhook(client, payload)
+    assert response.status_code == 200
+    assert response.get_json()['processed'] == 0
+
+    # After a restart the cache is empty; the stored-id lookup still skips it
+    instagram_webhooks._SEEN_MESSAGE_IDS.clear()
+    assert post_webhook(client, payload).get_json()['queued'] == 1
+    wait_for_inbox(app)
+    assert user_messages(app, sender_id) == 1
+    with app.app_context():
+        assert DMConversation.query.filter_by(instagram_user_id=sender_id).one().message_count == 1
+
+
+def test_duplicate_ids_within_one_payload_are_stored_once(app, client, sender_id):
+    mid = f'mid-{sender_id}-dup'
+    assert post_webhook(client, dm_payload(sender_id, mid, mid)).get_json()['queued'] == 1
+    wait_for_inbox(app)
+    assert user_messages(app, sender_id) == 1
+
+
+@pytest.mark.parametrize('signature', [
+    '',
+    'sha256=',
+    'sha256=not-hex',
+    'sha1=' + '0' * 40,
+    'sha256=' + '0' * 64,
+])
+def test_bad_signature_is_rejected(app, client, sender_id, signature):
+    response = post_webhook(client, dm_payload(sender_id, f'mid-{sender_id}-1'), signature=signature)
+    assert response.status_code == 403
+    with app.app_context():
+        assert DMConversation.query.filter_by(instagram_user_id=sender_id).count() == 0
+
+
+def test_signature_over_a_different_body_is_rejected(client, sender_id):
+    payload = dm_payload(sender_id, f'mid-{sender_id}-1')
+    forged = sign(json.dumps(dm_payload(sender_id, f'mid-{sender_id}-2')).encode('utf-8'))
+    assert post_webhook(client, payload, signature=forged).status_code == 403
+
+
+def test_replay_requeues_stale_pending_rows(app, sender_id):
+    now = datetime.utcnow()
+    stale_mid = f'mid-{sender_id}-stale'
+    fresh_mid = f'mid-{sender_id}-fresh'
+    with app.app_context():
+        stale = WebhookInbox(
+            events=json.dumps([[sender_id, None, stale_mid, 'left behind by a restart', 'entry.messaging']]),
+            received_at=now - instagram_webhooks.INBOX_REPLAY_AFTER - timedelta(seconds=1),
+        )
+        fresh = WebhookInbox(
+            events=json.dumps([[sender_id, None, fresh_mid, 'still in the pool', 'entry.messaging']]),
+            received_at=now,
+        )
+        db.session.add_all([stale, fresh])
+        db.session.commit()
+        stale_id, fresh_id = stale.id, fresh.id
+
+    instagram_webhooks._replay_webhook_inbox(app)
+
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        with app.app_context():
+            if db.session.get(WebhookInbox, stale_id).status != 'pending':
+                break
+        time.sleep(0.05)
+
+    with app.app_context():
+        assert db.session.get(WebhookInbox, stale_id).status == 'done'
+        # Rows younger than INBOX_REPLAY_AFTER may still be queued, so they're left alone
+        assert db.session.get(WebhookInbox, fresh_id).status == 'pending'
+        assert DMMessage.query.filter_by(instagram_message_id=stale_mid).count() == 1
+        assert DMMessage.query.filter_by(instagram_message_id=fresh_mid).count() == 0
+        db.session.delete(db.session.get(WebhookInbox, fresh_id))
+        db.session.commit()
+
+
+@pytest.mark.parametrize('unique_index', [True, False], ids=['upsert', 'select-then-insert'])
+def test_upsert_conversation_creates_then_bumps(app, sender_id, monkeypatch, unique_index):
+    monkeypatch.setattr(instagram_webhooks, '_has_unique_user_index', lambda: unique_index)
+    first_seen = datetime.utcnow() - timedelta(minutes=1)
+    last_seen = datetime.utcnow()
+    with app.app_context():
+        first_id = instagram_webhooks._upsert_conversation(sender_id, first_seen, count=2)
+        db.session.commit()
+        second_id = instagram_webhooks._upsert_conversation(sender_id, last_seen, count=3)
+        db.session.commit()
+
+        assert first_id == second_id
+        conversation = DMConversation.query.filter_by(instagram_user_id=sender_id).one()
+        assert conversation.id == first_id
+        assert conversation.message_count == 5
+        assert conversation.unread_count == 5
+        assert conversation.last_message_at == last_seen
+
+
+def test_sqlite_schema_supports_native_upsert(app):
+    with app.app_context():
+        assert instagram_webhooks._has_unique_user_index() is True
+
+
+def test_send_manual_reply_records_message_even_when_send_fails(app, sender_id, monkeypatch):
+    monkeypatch.setattr(
+        instagram_webhooks, 'send_instagram_message',
+        lambda recipient_id, text: {'success': False, 'message_id': None, 'error': 'token expired'},
+    )
+    with app.app_context():
+        conversation_id = instagram_webhooks._upsert_conversation(sender_id, datetime.utcnow())
+        db.session.commit()
+
+        conversation = db.session.get(DMConversation, conversation_id)
+        result = instagram_webhooks.send_manual_reply(conversation, 'On it!')
+        db.session.commit()
+
+        assert result['success'] is False
+        reply = DMMessage.query.filter_by(conversation_id=conversation_id, sender_type='bot').one()
+        assert reply.message_text == 'On it!'
+        assert reply.sent_successfully is False
+        assert reply.error_message == 'token expired'
+        assert reply.instagram_message_id
+        assert db.session.get(DMConversation, conversation_id).message_count == 2
+
+
+def test_set_conversation_status(app, sender_id):
+    with app.app_context():
+        conversation_id = instagram_webhooks._upsert_conversation(sender_id, datetime.utcnow())
+        db.session.commit()
+
+        assert instagram_webhooks.set_conversation_status(conversation_id, 'resolved') is True
+        db.session.commit()
+        assert db.session.get(DMConversation, conversation_id).conversation_status == 'resolved'
+
+        with pytest.raises(ValueError):
+            instagram_webhooks.set_conversation_status(conversation_id, 'deleted')
+        assert instagram_webhooks.set_conversation_status(-1, 'archived') is False
@@ -0,0 +1,30 @@
+"""
+Smoke test for the System Status Monitor API
+Run from the project root with: python -m pytest tests
+"""
+import time
+
+
+def test_system_status_returns_200(client):
+    response = client.get('/api/status/system')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['sqlDatabase']['status'] == 'operational'
+    for service in ('instaGraphApi', 'groqCloud', 'pinecone', 'scheduler', 'geminiApi'):
+        assert service in data
+    assert data['timestamp'] and data['generatedAt']
+
+
+def test_system_status_timestamp_is_per_response(client):
+    first = client.get('/api/status/system').get_json()
+    time.sleep(0.01)
+    second = client.get('/api/status/system').get_json()
+    # Served from the same cached payload, but stamped when each response is sent
+    assert first['generatedAt'] == second['generatedAt']
+    assert second['timestamp'] > first['timestamp']
+
+
+def test_system_status_gzip(client):
+    response = client.get('/api/status/system', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers.get('Content-Encoding') == 'gzip'